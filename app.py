@@ -1,34 +1,19 @@
 import streamlit as st
 from copy import deepcopy
+import hashlib
 import json
-import pathlib
-import tempfile
 import os
-import pandas as pd
-from datetime import datetime
+import time
 from dotenv import load_dotenv
-from pdf2image import convert_from_path
-
-from ocr_extractor import extract_page_json, merge_page_results
 from llm_handler import LLMHandler
+from page_cache import PageCache
+from extraction_jobs import JobManager
+import pipeline_metrics
+from pipeline_metrics import PipelineMetrics, record_prepared
 #from auth import start_google_login, handle_oauth_callback, get_current_user, logout
 from auth import start_login, handle_oauth_callback_gen, get_current_user, logout
 #from auth.manager import AuthManager
 
-# Loading JSON Schemas:
-# Scans a folder for schemaX.json.
-# Loads each schema as a dictionary keyed by page number (schemas[1], schemas[2], etc.).
-# Each schema defines form fields and types.
-SCHEMA_DIR = "./schemas"
-import sys
-#print(sys.path)
-schemas = {}
-for fname in os.listdir(SCHEMA_DIR):
-    if fname.startswith("schema") and fname.endswith(".json"):
-        num = int(fname.replace("schema", "").replace(".json", ""))
-        with open(os.path.join(SCHEMA_DIR, fname)) as f:
-            schemas[num] = json.load(f)
-
 # Streamlit page config & env:
 #Sets title, icon, and wide layout.
 #Loads environment variables from .env.
@@ -92,38 +77,6 @@ load_dotenv()
 #     # Scalar
 #     return (extracted if extracted is not None else None), schema
 
-#Converts a schema into a Python object structure with default values.
-# Handles:
-# Objects → recursive dict
-# Arrays → empty list
-# Scalars → None or actual value
-# Useful for initializing review data.
-def materialize_from_schema(obj):
-
-    if isinstance(obj, dict) and "value" in obj:
-        return materialize_from_schema(obj["value"])
-
-    if isinstance(obj, dict) and "properties" in obj:
-        result = {}
-        for key, val in obj["properties"].items():
-            result[key] = materialize_from_schema(val)
-        return result
-
-    if isinstance(obj, dict) and obj.get("type") == "array":
-        return []
-
-    if isinstance(obj, dict):
-        return {
-            k: materialize_from_schema(v)
-            for k, v in obj.items()
-            if k not in {"type", "enum", "description", "items"}
-        }
-
-    if isinstance(obj, list):
-        return [materialize_from_schema(x) for x in obj]
-
-    return obj
-
 # Rendering forms from schema:
 # Dynamically generates Streamlit input widgets based on a JSON schema.
 # Supports:
@@ -210,6 +163,7 @@ def render_from_schema(schema, values, key_prefix="review"):
 
             st.markdown(f"**{label}**")
 
+            import pandas as pd
             edited_df = st.data_editor(
                 pd.DataFrame(normalized_rows),
                 num_rows="dynamic",
@@ -277,6 +231,7 @@ def render_from_schema(schema, values, key_prefix="review"):
 def init_state():
     st.session_state.pdf_pages = None
     st.session_state.last_pdf = None
+    st.session_state.pdf_digest = None
     st.session_state.selected_pages = set()
     st.session_state.page_order = []
     st.session_state.page_schemas = {}
@@ -284,6 +239,8 @@ def init_state():
     st.session_state.schemas_confirmed = False
     st.session_state.extraction_complete = False
     st.session_state.extracted_data = None
+    st.session_state.extraction_job = None
+    st.session_state.pop("review_data", None)
 
 if "initialized" not in st.session_state:
     init_state()
@@ -342,6 +299,63 @@ if not user:
         )
     st.stop()
 
+# The extraction pipeline (PDF rendering, numpy/PIL image work, layout
+# templates) is imported only once the user is signed in, so the login page
+# does not wait for it.
+from pdf2image import convert_from_bytes
+from ocr_extractor import (
+    extract_pages_concurrent, merge_page_results, prefetch, build_schema_text,
+    materialize_from_schema, load_page_schemas, DEFAULT_BATCH_PAGES,
+)
+from blank_detection import BlankDetector, skip_summary
+from page_classifier import PageClassifier
+from pdf_pages import prepare_page, load_render_plan, RENDER_CONFIG
+from image_encoding import encode_page, get_profile
+
+# Loading JSON Schemas:
+# Scans a folder for schemaX.json.
+# Loads each schema as a dictionary keyed by schema number (schemas[1], schemas[2], etc.).
+# Each schema defines form fields and types. Uploaded pages are routed to a
+# schema by page_classifier (see st.session_state.page_schemas).
+# Loaded once per server process, not on every rerun; treat as read-only.
+SCHEMA_DIR = "./schemas"
+
+@st.cache_resource
+def get_schemas():
+    return load_page_schemas(SCHEMA_DIR)
+
+schemas = get_schemas()
+
+# Per-schema DPI and encoding profile (schemas/render.json, see pdf_pages).
+# Pages are rendered at RASTER_DPI on upload; a schema asking for less is
+# scaled down and one asking for more is rendered again from the upload.
+@st.cache_resource
+def get_render_plan():
+    return load_render_plan(os.path.join(SCHEMA_DIR, RENDER_CONFIG))
+
+# Rasterized uploads, shared across sessions and keyed by the file's hash,
+# so re-uploading the same PDF does not render it again. The page lists are
+# shared objects: never modify them in place.
+RASTER_DPI = 150
+
+@st.cache_resource(max_entries=int(os.getenv("RASTER_CACHE_ENTRIES", "8")), ttl=3600)
+def rasterize_upload(digest, _pdf_bytes, dpi=RASTER_DPI):
+    return convert_from_bytes(_pdf_bytes, dpi=dpi)
+
+# Page grid previews: small JPEGs made the first time a page is shown and
+# cached per (upload, page), so toggling a checkbox ships a few KB per page
+# instead of re-encoding the full rendering. PAGE_GRID_SIZE pages per view.
+THUMBNAIL_PROFILE = get_profile(os.getenv("THUMBNAIL_PROFILE", "jpeg:70,max=480"))
+PAGE_GRID_SIZE = int(os.getenv("PAGE_GRID_SIZE", "12"))
+
+@st.cache_data(max_entries=4000, ttl=3600, show_spinner=False)
+def page_thumbnail(digest, page_num, _page):
+    return encode_page(_page, THUMBNAIL_PROFILE).data
+
+@st.dialog("Page preview", width="large")
+def show_full_page(page_num):
+    st.image(st.session_state.pdf_pages[page_num - 1], caption=f"Page {page_num}")
+
 with st.sidebar:
     if user.picture:
         st.image(user.picture, width=64)
@@ -362,12 +376,154 @@ with st.sidebar:
 
 st.title("📝 Handwritten Form Extractor")
 
+# One page-result cache per server process, shared by all sessions.
+@st.cache_resource
+def get_page_cache():
+    return PageCache()
+
+# Blank templates are loaded once and reused across sessions.
+@st.cache_resource
+def get_blank_detector():
+    return BlankDetector()
+
+# Template layout index for routing pages to schemas, built once.
+@st.cache_resource
+def get_page_classifier():
+    return PageClassifier(schema_nums=schemas)
+
+# One client per server process; constructing it reloads .env and
+# reconfigures the provider, which should not happen on every rerun.
+@st.cache_resource
+def get_llm():
+    return LLMHandler()
+
 try:
-    llm = LLMHandler()
+    llm = get_llm()
 except Exception as e:
     st.error(f"Failed to initialize LLM: {e}")
     st.stop()
 
+# field_mapping.json compiled against the template and schemas, once.
+@st.cache_resource
+def get_export_plan():
+    from therap_export import compile_export_plan
+    return compile_export_plan(schemas)
+
+# Extraction runs as a background job shared by the server process; the
+# session keeps only its id, so a rerun or refresh picks it up again.
+EXTRACTION_POLL_S = float(os.getenv("EXTRACTION_POLL_S", "1.0"))
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager()
+
+def current_job():
+    job_id = st.session_state.get("extraction_job")
+    return get_job_manager().get(job_id) if job_id else None
+
+def sync_extraction_job():
+    """
+    Copy pages the job has finished into extracted_data (pages already there,
+    e.g. applied review edits, are kept) and mark extraction complete once
+    the job has stopped.
+    """
+    job = current_job()
+    if job is None:
+        return None
+    data = st.session_state.extracted_data or {}
+    for page_num, result in job.snapshot().items():
+        data.setdefault(page_num, result)
+    st.session_state.extracted_data = data
+    if not job.active and not st.session_state.extraction_complete:
+        st.session_state.extracted_data = {n: data[n] for n in sorted(data)}
+        st.session_state.extraction_complete = True
+    return job
+
+@st.fragment(run_every=EXTRACTION_POLL_S)
+def extraction_progress():
+    job = sync_extraction_job()
+    if job is None or not job.active:
+        # Finished: rerun the whole app once so every tab sees the result.
+        st.rerun()
+    st.progress(
+        job.done / job.total if job.total else 1.0,
+        text=f"Extracted {job.done}/{job.total} pages. Finished pages can be reviewed now.",
+    )
+    if job.cancelled:
+        st.caption("Cancelling: waiting for requests already sent.")
+    elif st.button("⏹ Cancel Extraction"):
+        job.cancel()
+
+def report_extraction(job):
+    if job.status == "done":
+        st.success("Extraction complete.")
+    elif job.status == "cancelled":
+        st.warning(f"Extraction cancelled after {job.done}/{job.total} pages.")
+    else:
+        st.error(f"Extraction failed after {job.done}/{job.total} pages: {job.error}")
+    for record in sorted(job.failures, key=lambda r: r["page"]):
+        st.warning(
+            f"Page {record['page']} could not be extracted "
+            f"({record['error']} after {record['attempts']} attempts): {record['message']}"
+        )
+    skips = job.info.get("blank")
+    if skips and (skips["blank_pages"] or skips["blank_sections"]):
+        st.caption(
+            f"Blank detection: {skips['blank_pages']}/{skips['pages']} pages skipped "
+            f"({skips['skip_rate']:.0%}), {skips['blank_sections']} blank sections"
+        )
+    stats = get_page_cache().stats()
+    st.caption(f"Page cache: {stats['hits']} hits / {stats['misses']} misses")
+    usage = job.info.get("usage")
+    if usage and usage["calls"]:
+        st.caption(
+            f"Tokens: {usage['prompt_tokens']} prompt / {usage['response_tokens']} response "
+            f"({usage['prompt_tokens_per_call']:.0f} prompt tokens per request)"
+        )
+    if "payload_kib" in job.info:
+        st.caption(
+            f"Upload payload: {job.info['payload_kib']:.0f} KiB/page, "
+            f"encode {job.info['encode_ms']:.0f} ms/page"
+        )
+    if "metrics" in job.info:
+        show_metrics(job.info["metrics"])
+
+def show_metrics(metrics):
+    """Per-stage and per-page metrics of one extraction run (pipeline_metrics)."""
+    import pandas as pd
+    summary = metrics.summary()
+    if not summary:
+        return
+    with st.expander("📊 Run metrics"):
+        st.dataframe(
+            pd.DataFrame([
+                {"stage": stage, "events": row["count"], "total s": row["ms"] / 1000,
+                 "p50 ms": row["p50_ms"], "p95 ms": row["p95_ms"],
+                 **{name: row.get(name, 0) for name in pipeline_metrics.SUMMED_FIELDS}}
+                for stage, row in summary.items()
+            ]).set_index("stage"),
+            use_container_width=True,
+        )
+        pages = {}
+        for event in metrics.events:
+            if "page" in event:
+                row = pages.setdefault(event["page"], {"page": event["page"]})
+                key = f"{event['stage']} ms"
+                row[key] = row.get(key, 0.0) + event.get("ms", 0.0)
+                if event.get("bytes") and event["stage"] == "encode":
+                    row["bytes"] = row.get("bytes", 0) + event["bytes"]
+        if pages:
+            st.dataframe(pd.DataFrame([pages[n] for n in sorted(pages)]).set_index("page"),
+                         use_container_width=True)
+        st.download_button(
+            "⬇️ Metrics (JSON lines)",
+            "".join(json.dumps(e, default=str) + "\n" for e in metrics.events),
+            file_name=f"metrics-{metrics.run_id}.jsonl",
+            mime="application/x-ndjson",
+        )
+
+sync_extraction_job()
+
 #Tabs: Upload / Pages / Review / Export
 #Upload tab
 #Pages tab
@@ -375,18 +531,33 @@ except Exception as e:
 #Lets user select/deselect pages.
 #Confirm selection.
 #Extracts data from selected pages using OCR + LLM.
-if uploaded_pdf and uploaded_pdf.name != st.session_state.last_pdf:
+if uploaded_pdf and uploaded_pdf.file_id != st.session_state.last_pdf:
+    if current_job() is not None:
+        current_job().cancel()
     init_state()
 
-    temp_pdf = pathlib.Path(f"./temp_{uploaded_pdf.name}")
-    temp_pdf.write_bytes(uploaded_pdf.read())
-
-    pages = convert_from_path(temp_pdf, dpi=150)
+    pdf_bytes = uploaded_pdf.getvalue()
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    render_start = time.perf_counter()
+    pages = rasterize_upload(digest, pdf_bytes)
+    # Reported with the extraction metrics (near zero when the render was cached).
+    st.session_state.render_ms = (time.perf_counter() - render_start) * 1000
     st.session_state.pdf_pages = pages
-    st.session_state.last_pdf = uploaded_pdf.name
+    st.session_state.pdf_digest = digest
+    st.session_state.last_pdf = uploaded_pdf.file_id
     st.session_state.page_order = list(range(1, len(pages) + 1))
     st.session_state.selected_pages = set(st.session_state.page_order)
 
+    # Route every page to a schema by its layout (position when no
+    # templates are registered); the Pages tab lets the user correct it.
+    classifier = get_page_classifier()
+    st.session_state.page_matches = {}
+    for page_num, page in enumerate(pages, start=1):
+        st.session_state.pop(f"schema_{page_num}", None)
+        schema_num, match = classifier.route(page_num, page)
+        st.session_state.page_schemas[page_num] = schema_num
+        st.session_state.page_matches[page_num] = match
+
 tab_upload, tab_pages, tab_review, tab_export = st.tabs([
     "📤 Upload",
     "📄 Pages & Schema",
@@ -435,10 +606,24 @@ with tab_pages:
             st.session_state.pages_confirmed = False
             st.rerun()
 
+    # Only one view of the grid is rendered per rerun.
+    grid_count = -(-total_pages // PAGE_GRID_SIZE)
+    grid_page = 1
+    if grid_count > 1:
+        grid_page = st.number_input(
+            f"Pages view (of {grid_count})", min_value=1, max_value=grid_count,
+            step=1, key="grid_page",
+        )
+    first = (grid_page - 1) * PAGE_GRID_SIZE + 1
+    visible = range(first, min(first + PAGE_GRID_SIZE, total_pages + 1))
+
     cols = st.columns(3)
-    for idx, page_num in enumerate(range(1, total_pages + 1)):
+    for idx, page_num in enumerate(visible):
         with cols[idx % 3]:
-            st.image(pages[page_num - 1], caption=f"Page {page_num}")
+            thumb = page_thumbnail(st.session_state.pdf_digest, page_num, pages[page_num - 1])
+            st.image(thumb, caption=f"Page {page_num}", use_container_width=True)
+            if st.button("🔍 Full size", key=f"zoom_{page_num}"):
+                show_full_page(page_num)
             checked = st.checkbox(
                 f"Include Page {page_num}",
                 value=(page_num in st.session_state.selected_pages),
@@ -450,7 +635,25 @@ with tab_pages:
             else:
                 new_selection.discard(page_num)
 
+            schema_options = sorted(schemas)
+            assigned = st.session_state.page_schemas.get(page_num)
+            st.session_state.page_schemas[page_num] = st.selectbox(
+                "Schema",
+                schema_options,
+                index=schema_options.index(assigned) if assigned in schema_options else None,
+                format_func=lambda n: f"schema{n}",
+                key=f"schema_{page_num}",
+                disabled=st.session_state.extraction_complete
+                or st.session_state.get("extraction_job") is not None,
+            )
+            match = st.session_state.get("page_matches", {}).get(page_num)
+            if match is not None:
+                note = "" if match.confident else " — please check"
+                st.caption(f"Layout match: schema{match.schema_num} ({match.score:.2f}){note}")
+
     if not st.session_state.pages_confirmed:
+        # Keep toggles on views that are not shown on this rerun.
+        st.session_state.selected_pages = new_selection
         if st.button("Confirm Selected Pages", type="primary"):
             if not new_selection:
                 st.warning("Select at least one page.")
@@ -467,48 +670,99 @@ with tab_pages:
     if not st.session_state.pages_confirmed:
         st.stop()
 
-    if not st.session_state.extraction_complete:
+    job = current_job()
+    if job is not None and job.active:
+        extraction_progress()
+    elif not st.session_state.extraction_complete:
         if st.button("🚀 Run Extraction", type="primary"):
-            all_page_data = []
-            progress = st.progress(0)
-            status = st.empty()
-
             selected = sorted(st.session_state.selected_pages)
+            assigned = dict(st.session_state.page_schemas)
 
-            for idx, page_num in enumerate(selected, start=1):
-                status.write(f"Processing page {page_num}")
-                page = pages[page_num - 1]
-
-                schema = schemas.get(page_num)
-                if not schema:
-                    raise ValueError(f"No schema file found for page {page_num}")
-
-                with tempfile.NamedTemporaryFile(suffix=".png") as tmp:
-                    page.save(tmp.name, "PNG")
-                    img_bytes = open(tmp.name, "rb").read()
-
-                page_json = extract_page_json(
-                    llm,
-                    img_bytes,
-                    page_num,
-                    json.dumps(schema),
-                )
-
-                # all_page_data.append(page_json)
-                all_page_data.append({
-                    "page": page_num,
-                    "data": page_json
-                })
-                progress.progress(idx / len(selected))
-
-            # st.session_state.extracted_data = merge_page_results(all_page_data)
-            st.session_state.extracted_data = {
-                item["page"]: item["data"]
-                for item in all_page_data
-            }
-            st.session_state.extraction_complete = True
-            st.success("Extraction complete.")
+            missing = [n for n in selected if assigned.get(n) not in schemas]
+            if missing:
+                st.error(f"Choose a schema for page(s) {', '.join(map(str, missing))}.")
+                st.stop()
 
+            # Pages with no ink beyond their blank template are not sent.
+            # With PAGE_CROP_SECTIONS=1 each schema section goes out as its
+            # own crop of the aligned page.
+            detector = get_blank_detector()
+            crop_plan = None
+            if os.getenv("PAGE_CROP_SECTIONS", "0") == "1":
+                crop_plan = {n: list(s.get("properties", {})) for n, s in schemas.items()}
+            cache = get_page_cache()
+            pdf_name = uploaded_pdf.name if uploaded_pdf else None
+            pdf_bytes = uploaded_pdf.getvalue() if uploaded_pdf else None
+            render_plan = get_render_plan()
+
+            def rerender(page_num):
+                if pdf_bytes is None:
+                    return None
+                return lambda dpi: convert_from_bytes(
+                    pdf_bytes, dpi=dpi, first_page=page_num, last_page=page_num,
+                )[0]
+            render_ms = st.session_state.get("render_ms")
+
+            # Runs on a job thread: no st.* calls in here.
+            def run_extraction(job):
+                metrics = job.info["metrics"] = PipelineMetrics(keep_events=True)
+                with metrics.activate(), pipeline_metrics.labels(pdf=pdf_name):
+                    extract_selected(job, metrics)
+
+            def extract_selected(job, metrics):
+                encoded_pages = []
+                blank_reports = []
+                if render_ms is not None:
+                    metrics.record("render", render_ms, pdf=pdf_name, pages=len(pages), target="upload")
+
+                # Encode lazily on a producer thread so encoding overlaps with
+                # the in-flight LLM calls. Profile comes from IMAGE_ENCODING_PROFILE.
+                # Cancelling stops handing out pages.
+                def encode_selected():
+                    for page_num in selected:
+                        if job.cancelled:
+                            return
+                        prepared = prepare_page(
+                            page_num, pages[page_num - 1], detector=detector,
+                            crop_plan=crop_plan, schema_num=assigned[page_num],
+                            dpi=RASTER_DPI, render_plan=render_plan,
+                            rerender=rerender(page_num),
+                        )
+                        record_prepared(page_num, prepared)
+                        payload = prepared.payload
+                        blank_reports.append(prepared.report)
+                        if isinstance(payload, dict):
+                            encoded_pages.extend(payload.values())
+                        elif payload is not None:
+                            encoded_pages.append(payload)
+                        yield page_num, payload, prepared.report
+
+                usage_start = llm.usage_summary()
+                try:
+                    extract_pages_concurrent(
+                        llm,
+                        prefetch(encode_selected()),
+                        lambda page_num: build_schema_text(schemas[assigned[page_num]]),
+                        total=len(selected),
+                        cache=cache,
+                        on_result=job.add_result,
+                        failures=job.failures,
+                        page_schema=lambda page_num: schemas[assigned[page_num]],
+                        batch_pages=DEFAULT_BATCH_PAGES,
+                    )
+                finally:
+                    job.info["blank"] = skip_summary(blank_reports)
+                    job.info["usage"] = llm.usage_summary(since=usage_start)
+                    if encoded_pages:
+                        job.info["payload_kib"] = sum(e.size for e in encoded_pages) / 1024 / len(encoded_pages)
+                        job.info["encode_ms"] = sum(e.encode_ms for e in encoded_pages) / len(encoded_pages)
+
+            job = get_job_manager().submit(selected, run_extraction)
+            st.session_state.extraction_job = job.job_id
+            st.session_state.extracted_data = {}
+            st.rerun()
+    elif job is not None:
+        report_extraction(job)
 
 #Review tab
 #Allows editing the extracted data.
@@ -519,8 +773,8 @@ with tab_pages:
 #Behavioral concerns (checkbox + description/frequency)
 #Can confirm changes or apply to final output.
 with tab_review:
-    if not st.session_state.get("extraction_complete"):
-        st.info("Run extraction first.")
+    if not st.session_state.get("extracted_data"):
+        st.info("Run extraction first. Finished pages show up here while the rest are extracted.")
         st.stop()
 
     st.header("✏️ Review Extracted Form Data")
@@ -540,13 +794,11 @@ with tab_review:
 
     #     st.session_state.review_data = full_data
 
-    if "review_data" not in st.session_state:
-        st.session_state.review_data = {
-            page_num: materialize_from_schema(page_data)
-            for page_num, page_data in st.session_state.extracted_data.items()
-        }
-    
-    review_data = st.session_state.review_data
+    # Pages finished by a running job are added as they arrive.
+    review_data = st.session_state.setdefault("review_data", {})
+    for page_num, page_data in st.session_state.extracted_data.items():
+        if page_num not in review_data:
+            review_data[page_num] = materialize_from_schema(page_data)
 
     available_pages = sorted(review_data.keys())
 
@@ -627,7 +879,7 @@ with tab_review:
 
     edited_output = {}
     edited_output[page_num] = render_from_schema(
-        schemas[page_num],
+        schemas[st.session_state.page_schemas[page_num]],
         review_data[page_num],
         key_prefix=f"review.page{page_num}"
     )
@@ -660,6 +912,18 @@ with tab_export:
 
     st.subheader("📥 Export")
 
+    plan = get_export_plan()
+    st.caption(
+        f"{len(plan.mapped_paths)} of {len(plan.columns)} Therap columns are mapped; "
+        f"{len(plan.unmapped_fields)} schema fields go to the extra fields file."
+    )
+    if plan.unknown_paths or plan.unknown_columns:
+        with st.expander("Mapping problems"):
+            for path in plan.unknown_paths:
+                st.write(f"`{path}` is mapped but no schema defines it")
+            for column in plan.unknown_columns:
+                st.write(f"`{column}` is not a column of the import template")
+
     if st.button("Send to Therap"):
         base_name = st.session_state.get("base_name", "export")
         edited_data = st.session_state.get("extracted_data") or {}
@@ -668,69 +932,32 @@ with tab_export:
             st.stop()
 
 
-        with open("field_mapping.json", "r") as f:
-            mapping_json = json.load(f)
-
-        mapping = mapping_json.get("mappings", {})
-        reverse_map = {v: k for k, v in mapping.items() if v}
-
-        def flatten_json(data, parent_key="", sep="."):
-            items = {}
-            for k, v in data.items():
-                new_key = f"{parent_key}{sep}{k}" if parent_key else k
-                if isinstance(v, dict):
-                    items.update(flatten_json(v, new_key, sep))
-                else:
-                    items[new_key] = v
-            return items
-
-        merged = {}
-        for page_data in edited_data.values():
-            merged.update(page_data)
-
-        flat_data = flatten_json(merged)
-        extracted_df = pd.DataFrame([flat_data])
-
-        idf_df = pd.read_excel("IDF_Import_ProviderExcel_TOT-AZ_20251019.xlsx") #idf_path)
-        idf_cols = list(idf_df.columns)
-
-        official_df = pd.DataFrame(columns=idf_cols)
-
-        for col in idf_cols:
-            source_key = reverse_map.get(col)
-            if source_key and source_key in extracted_df.columns:
-                official_df[col] = extracted_df[source_key]
-            else:
-                official_df[col] = ""
-
-        mapped_extract_cols = set(reverse_map.values())
-        extra_cols = [c for c in extracted_df.columns if c not in mapped_extract_cols]
-        extra_df = extracted_df[extra_cols] if extra_cols else pd.DataFrame()
-
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        official_file = f"./{base_name}_import_ready_{ts}.xlsx"
-        extra_file = f"./{base_name}_extra_fields_{ts}.xlsx"
-
-        official_df.to_excel(official_file, index=False)
-
-        if not extra_df.empty:
-            extra_df.to_excel(extra_file, index=False)
+        # Workbooks are built in memory; nothing is written to the server disk.
+        from therap_export import build_export_frames, export_workbooks, export_file_names
+        export_start = time.perf_counter()
+        official_df, extra_df = build_export_frames(edited_data, plan=plan)
+        official_xlsx, extra_xlsx = export_workbooks(official_df, extra_df)
+        job = current_job()
+        if job is not None and "metrics" in job.info:
+            job.info["metrics"].record(
+                "export", (time.perf_counter() - export_start) * 1000, target="xlsx",
+                bytes=len(official_xlsx) + len(extra_xlsx or b""),
+            )
+        official_name, extra_name = export_file_names(base_name)
 
         st.success("Files generated successfully")
 
-        with open(official_file, "rb") as f:
+        st.download_button(
+            "⬇️ Download Import-Ready Excel (Therap Schema)",
+            official_xlsx,
+            file_name=official_name,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+
+        if extra_xlsx:
             st.download_button(
-                "⬇️ Download Import-Ready Excel (Therap Schema)",
-                f,
-                file_name=os.path.basename(official_file),
+                "⬇️ Download Extra Fields Excel",
+                extra_xlsx,
+                file_name=extra_name,
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             )
-
-        if not extra_df.empty:
-            with open(extra_file, "rb") as f:
-                st.download_button(
-                    "⬇️ Download Extra Fields Excel",
-                    f,
-                    file_name=os.path.basename(extra_file),
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                )
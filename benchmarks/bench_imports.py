@@ -0,0 +1,159 @@
+"""
+Import-time benchmark.
+
+Imports each entry point in a fresh interpreter under `python -X importtime`
+and reports its cumulative import time (median of --repeat runs) and the
+slowest modules it pulls in. Exits non-zero when an entry point goes over
+its budget or imports a module it must not (the CLI must never load
+Streamlit or a provider SDK at startup), so it can run as a CI check.
+
+    python benchmarks/bench_imports.py
+    python benchmarks/bench_imports.py --budget ocr_extractor=250 --out imports.json
+    python benchmarks/bench_imports.py --baseline imports.json
+
+The app is measured up to its login page: "app (pre-login)" runs app.py
+under Streamlit's AppTest with nobody signed in and counts every import
+the script makes (the test harness itself aside).
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# entry point -> (budget in ms, modules it must not import)
+TARGETS = {
+    "ocr_extractor": (400, ("streamlit", "google.generativeai", "pandas", "pyarrow")),
+    "pdf_pages": (300, ("streamlit", "google.generativeai", "pandas")),
+    "llm_handler": (150, ("streamlit", "google.generativeai")),
+    "result_sink": (50, ("pyarrow",)),
+    "therap_export": (900, ("streamlit", "google.generativeai")),
+    "app (pre-login)": (500, (
+        "google.generativeai", "pandas", "numpy", "PIL", "pdf2image",
+        "ocr_extractor", "pdf_pages", "authlib",
+    )),
+}
+
+# Entry points measured by running code rather than importing a module:
+# name -> (code, modules the harness imports for itself, not counted)
+SCRIPTS = {
+    "app (pre-login)": ("""
+import streamlit
+from streamlit.testing.v1 import AppTest
+AppTest.from_file("app.py", default_timeout=60).run()
+""", ("streamlit.testing.v1",)),
+}
+
+
+def import_profile(module, code=None, exclude=()):
+    """
+    One cold import -> (cumulative ms, {module: cumulative ms}). With
+    `code`, that is run instead and the ms are the sum of its top-level
+    imports outside `exclude`.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code or f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    top_level = 0.0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        ms = int(cumulative) / 1000
+        # Nested imports are indented by two spaces per level.
+        if not name[1:].startswith(" ") and name.strip() not in exclude:
+            top_level += ms
+        modules[name.strip()] = ms
+    return (top_level if code else modules.get(module, 0.0)), modules
+
+def measure(module, repeat, budget, forbidden, top, startup=()):
+    code, harness = SCRIPTS.get(module, (None, ()))
+    times = []
+    modules = {}
+    for _ in range(max(1, repeat)):
+        ms, modules = import_profile(module, code, set(startup) | set(harness))
+        times.append(ms)
+    loaded = [name for name in forbidden if name in modules]
+    slowest = sorted(
+        ((ms, name) for name, ms in modules.items()
+         if name != module and name not in startup and name not in harness),
+        reverse=True,
+    )
+    return {
+        "ms": statistics.median(times),
+        "min_ms": min(times),
+        "budget_ms": budget,
+        "modules": len(modules),
+        "forbidden": loaded,
+        "slowest": [{"module": name, "ms": round(ms, 1)} for ms, name in slowest[:top]],
+    }
+
+def compare(report, baseline):
+    """Print relative change of each entry point's import time versus a saved report."""
+    print(f"{'entry point':<22}{'baseline':>12}{'current':>12}{'change':>10}", file=sys.stderr)
+    for module, stats in report.items():
+        base = baseline.get(module, {}).get("ms")
+        if not base:
+            continue
+        print(f"{module:<22}{base:>12.1f}{stats['ms']:>12.1f}{(stats['ms'] - base) / base:>+10.1%}",
+              file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark")
+    parser.add_argument("modules", nargs="*", help=f"Entry points (default: {', '.join(TARGETS)})")
+    parser.add_argument("--repeat", type=int, default=5, help="Cold imports per entry point")
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS",
+                        help="Override an entry point's budget")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imported modules to list")
+    parser.add_argument("--out", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Compare against a previously saved report")
+    args = parser.parse_args()
+
+    budgets = {module: budget for module, (budget, _) in TARGETS.items()}
+    for item in args.budget:
+        module, _, ms = item.partition("=")
+        budgets[module] = float(ms)
+
+    # Modules the interpreter loads before running anything (site, encodings, ...).
+    startup = set(import_profile(None, "pass")[1])
+
+    report = {}
+    failed = []
+    for module in args.modules or list(TARGETS):
+        forbidden = TARGETS.get(module, (None, ()))[1]
+        stats = measure(module, args.repeat, budgets.get(module), forbidden, args.top, startup)
+        report[module] = stats
+        over = stats["budget_ms"] is not None and stats["ms"] > stats["budget_ms"]
+        status = "OVER BUDGET" if over else "ok"
+        if stats["forbidden"]:
+            status = f"imports {', '.join(stats['forbidden'])}"
+        if over or stats["forbidden"]:
+            failed.append(module)
+        budget = f"{stats['budget_ms']:.0f}" if stats["budget_ms"] is not None else "-"
+        print(f"{module:<22}{stats['ms']:>8.1f} ms  (budget {budget} ms)  {status}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+End-to-end pipeline benchmark.
+
+Generates synthetic filled-form PDFs with one page per schemas/schemaN.json,
+then runs every stage of the pipeline against the local synthetic LLM
+backend:
+
+    rasterize (pdf2image) -> encode -> extract_page_json -> merge -> Therap export
+
+and prints a JSON report with per-stage latency percentiles, throughput and
+peak RSS. Rasterize, encode and extract are sampled per page (extract: the
+page's scheduled requests, from the pipeline_metrics request events), merge
+and export per document. Save reports from two commits and compare them with --baseline.
+
+    python benchmarks/bench_pipeline.py --docs 5 --out bench.json
+    python benchmarks/bench_pipeline.py --docs 5 --baseline bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import contextlib
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault("LLM_BACKEND", "synthetic")
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from llm_backends import SyntheticBackend  # noqa: E402
+from schema_compiler import iter_fields  # noqa: E402
+from image_encoding import encode_page, DEFAULT_PROFILE  # noqa: E402
+from pdf_pages import iter_pdf_pages  # noqa: E402
+from ocr_extractor import (  # noqa: E402
+    build_schema_text, extract_pages_concurrent, merge_page_results,
+)
+from therap_export import build_export_frames, compile_export_plan, export_workbooks  # noqa: E402
+from request_scheduler import RequestScheduler  # noqa: E402
+from pipeline_metrics import PipelineMetrics  # noqa: E402
+
+PAGE_SIZE = (1275, 1650)  # US Letter at 150 DPI
+
+
+def load_schemas():
+    schemas = {}
+    for path in (ROOT / "schemas").glob("schema*.json"):
+        with open(path, "r", encoding="utf-8") as f:
+            schemas[int(path.stem.replace("schema", ""))] = json.load(f)
+    return dict(sorted(schemas.items()))
+
+def draw_form_page(page_num, schema, rng):
+    """A printed-label form page with pseudo-handwritten answers."""
+    image = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((80, 50), f"INTAKE PACKET - PAGE {page_num}", fill="black")
+    y = 100
+    for path, _ in iter_fields(schema):
+        if y > PAGE_SIZE[1] - 60:
+            break
+        label = path.rsplit(".", 1)[-1].replace("_", " ").title()
+        draw.text((80, y), f"{label}:", fill="black")
+        draw.line((400, y + 12, PAGE_SIZE[0] - 80, y + 12), fill="gray")
+        if rng.random() < 0.7:
+            # Slightly jittered blue "ink".
+            draw.text((410 + rng.randint(-4, 4), y - 2 + rng.randint(-2, 2)),
+                      SyntheticBackend.fake_text(label, rng), fill=(20, 30, 140))
+        y += 34
+    return image
+
+def make_pdf(path, schemas, rng):
+    pages = [draw_form_page(num, schema, rng) for num, schema in schemas.items()]
+    pages[0].save(path, "PDF", resolution=150, save_all=True, append_images=pages[1:])
+
+class TimedLLM:
+    """Proxy that records the latency of every generate_json call."""
+
+    def __init__(self, llm, timings):
+        self.llm = llm
+        self.timings = timings
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def generate_json(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.llm.generate_json(*args, **kwargs)
+        finally:
+            self.timings.append(time.perf_counter() - start)
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    from llm_handler import LLMHandler
+
+    schemas = load_schemas()
+    export_plan = compile_export_plan(schemas)
+    rng = random.Random(args.seed)
+    os.environ["LLM_SYNTHETIC_LATENCY_MS"] = str(args.latency_ms)
+    llm_timings = []
+    llm = TimedLLM(LLMHandler(), llm_timings)
+    # No real provider behind the fake model: do not throttle it.
+    scheduler = RequestScheduler(requests_per_minute=1e9, tokens_per_minute=1e12)
+
+    stages = {name: [] for name in ("rasterize", "encode", "extract", "merge", "export")}
+    encoded_bytes = []
+    pages_done = 0
+    # Per-page extract times come from the request events of this collector.
+    metrics = PipelineMetrics(keep_events=True)
+    seen = 0
+
+    with tempfile.TemporaryDirectory() as workdir, metrics.activate():
+        start_all = time.perf_counter()
+        for doc in range(args.docs):
+            pdf_path = Path(workdir) / f"form_{doc:03d}.pdf"
+            make_pdf(pdf_path, schemas, rng)
+
+            encoded = []
+            page_iter = iter_pdf_pages(pdf_path, dpi=args.dpi)
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    page_num, image = next(page_iter)
+                except StopIteration:
+                    break
+                t1 = time.perf_counter()
+                page = encode_page(image, args.encoding)
+                t2 = time.perf_counter()
+                stages["rasterize"].append(t1 - t0)
+                stages["encode"].append(t2 - t1)
+                encoded_bytes.append(page.size)
+                encoded.append((page_num, page))
+                del image
+
+            results = extract_pages_concurrent(
+                llm, encoded,
+                lambda num: build_schema_text(schemas.get(num, {}), args.schema_format),
+                max_workers=args.workers, scheduler=scheduler,
+            )
+            extract_s = {}
+            for event in metrics.events[seen:]:
+                if event["stage"] == "request" and "page" in event:
+                    extract_s[event["page"]] = extract_s.get(event["page"], 0.0) + event["ms"] / 1000
+            seen = len(metrics.events)
+            stages["extract"].extend(extract_s.values())
+            pages_done += len(results)
+
+            t0 = time.perf_counter()
+            merge_page_results(results)
+            page_data = {num: data for (num, _), data in zip(encoded, results)}
+            stages["merge"].append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            official_df, extra_df = build_export_frames(page_data, plan=export_plan)
+            export_workbooks(official_df, extra_df)
+            stages["export"].append(time.perf_counter() - t0)
+
+        wall = time.perf_counter() - start_all
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "docs": args.docs,
+            "pages_per_doc": len(schemas),
+            "dpi": args.dpi,
+            "encoding": args.encoding,
+            "schema_format": args.schema_format,
+            "workers": args.workers,
+            "fake_latency_ms": args.latency_ms,
+        },
+        "stages": {name: percentiles(samples) for name, samples in stages.items()},
+        "llm_call": percentiles(llm_timings),
+        "pages": pages_done,
+        "wall_s": wall,
+        "pages_per_s": pages_done / wall if wall else 0.0,
+        "bytes_per_page": sum(encoded_bytes) / len(encoded_bytes) if encoded_bytes else 0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def compare(report, baseline):
+    """Print relative change of the headline numbers versus a saved report."""
+    rows = [("pages_per_s", report["pages_per_s"], baseline.get("pages_per_s")),
+            ("peak_rss_mb", report["peak_rss_mb"], baseline.get("peak_rss_mb")),
+            ("bytes_per_page", report["bytes_per_page"], baseline.get("bytes_per_page"))]
+    for stage, stats in report["stages"].items():
+        base = baseline.get("stages", {}).get(stage, {})
+        rows.append((f"{stage}.p50_ms", stats.get("p50_ms"), base.get("p50_ms")))
+    print(f"{'metric':<22}{'baseline':>12}{'current':>12}{'change':>10}", file=sys.stderr)
+    for name, current, base in rows:
+        if current is None or not base:
+            continue
+        print(f"{name:<22}{base:>12.1f}{current:>12.1f}{(current - base) / base:>+10.1%}",
+              file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    parser.add_argument("--docs", type=int, default=3, help="Synthetic PDFs to process")
+    parser.add_argument("--dpi", type=int, default=150, help="Rasterization resolution")
+    parser.add_argument("--encoding", default=DEFAULT_PROFILE, help="Image encoding profile")
+    parser.add_argument("--schema-format", choices=["compact", "json"], default="compact")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent LLM calls")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Simulated model latency (0 measures pipeline overhead only)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="Compare against a previously saved report")
+    args = parser.parse_args()
+
+    # Pipeline progress goes to stderr so stdout carries only the report.
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from page_templates import (
+    TEMPLATE_DIR, to_analysis_gray, load_template, load_sections, box_slice,
+    estimate_offset, shift_array,
+)
+
+# Local blank-page / blank-section detection.
+#
+# A page (or section) is "blank" when it carries no ink beyond what is printed
+# on the registered blank template of that page, after aligning the scan to
+# the template. Such pages never go to the model; their schema defaults are
+# filled in directly. Without a template only pages that are almost entirely
+# white are treated as blank.
+
+# A page or section counts as blank below this many added-ink pixels at
+# analysis resolution. A short handwritten word or a check mark leaves tens to
+# hundreds; isolated scanner specks are mostly smoothed out by the downscale.
+# Kept low on purpose: a missed blank page costs one model call, a false one
+# loses data.
+DEFAULT_MIN_INK_PX = int(os.getenv("BLANK_MIN_INK_PX", "6"))
+
+# Gray level below which a pixel counts as ink (blue/black pen and pencil).
+DARK_LEVEL = 160
+
+
+@dataclass
+class BlankReport:
+    page_num: int
+    ink: float                       # fraction of pixels with added ink
+    ink_px: int
+    blank: bool
+    has_template: bool
+    blank_sections: List[str] = field(default_factory=list)
+    section_ink: Optional[dict] = None  # added-ink pixels per section
+    offset: Tuple[int, int] = (0, 0)    # (dy, dx) of the scan vs. its template
+    shape: Optional[Tuple[int, int]] = None  # analysis shape the offset refers to
+
+
+def dilate(mask, radius):
+    """Binary dilation with a square kernel, done separably with array shifts."""
+    if radius <= 0:
+        return mask
+    out = mask.copy()
+    for shift in range(1, radius + 1):
+        out[shift:, :] |= mask[:-shift, :]
+        out[:-shift, :] |= mask[shift:, :]
+    rows = out.copy()
+    for shift in range(1, radius + 1):
+        out[:, shift:] |= rows[:, :-shift]
+        out[:, :-shift] |= rows[:, shift:]
+    return out
+
+
+class BlankDetector:
+    def __init__(self, template_dir=TEMPLATE_DIR, min_ink_px=DEFAULT_MIN_INK_PX,
+                 tolerance_px=3, align=True):
+        """
+        min_ink_px    -> added-ink pixels under which a page/section is blank
+        tolerance_px  -> template ink is grown by this much so residual
+                         misalignment does not count as handwriting
+        align         -> correct scan offsets by phase correlation first
+        """
+        self.template_dir = str(template_dir)
+        self.min_ink_px = min_ink_px
+        self.tolerance_px = tolerance_px
+        self.align = align
+        self._templates = {}
+        self._sections = None
+
+    def __getstate__(self):
+        # Sent to render worker processes: ship settings, not loaded arrays.
+        state = self.__dict__.copy()
+        state["_templates"] = {}
+        state["_sections"] = None
+        return state
+
+    def template(self, page_num):
+        """(template gray, dilated template ink) or None without a template."""
+        if page_num not in self._templates:
+            template = load_template(page_num, self.template_dir)
+            self._templates[page_num] = (
+                None if template is None
+                else (template, dilate(template < DARK_LEVEL, self.tolerance_px))
+            )
+        return self._templates[page_num]
+
+    def sections(self, page_num):
+        if self._sections is None:
+            self._sections = load_sections(self.template_dir)
+        return self._sections.get(page_num, {})
+
+    def added_ink(self, page_num, image):
+        """Mask of ink not printed on the template, and the scan offset (None without template)."""
+        template = self.template(page_num)
+        if template is None:
+            return to_analysis_gray(image) < DARK_LEVEL, None
+        template_gray, template_ink = template
+        page_gray = to_analysis_gray(image, template_gray.shape)
+        offset = estimate_offset(page_gray, template_gray) if self.align else (0, 0)
+        return (page_gray < DARK_LEVEL) & ~shift_array(template_ink, offset, False), offset
+
+    def check(self, page_num, image):
+        added, offset = self.added_ink(page_num, image)
+        ink_px = int(added.sum())
+        has_template = offset is not None
+        report = BlankReport(page_num, ink_px / added.size, ink_px,
+                             ink_px < self.min_ink_px, has_template,
+                             offset=offset or (0, 0), shape=added.shape)
+
+        if has_template and not report.blank:
+            report.section_ink = {
+                name: int(added[box_slice(box, added.shape, offset)].sum())
+                for name, box in self.sections(page_num).items()
+            }
+            report.blank_sections = [
+                name for name, value in report.section_ink.items() if value < self.min_ink_px
+            ]
+        return report
+
+
+def skip_summary(reports):
+    """Counts for reporting how much model work blank detection saved."""
+    reports = list(reports)
+    skipped = sum(r.blank for r in reports)
+    sections = sum(len(r.blank_sections) for r in reports if not r.blank)
+    return {
+        "pages": len(reports),
+        "blank_pages": skipped,
+        "skip_rate": skipped / len(reports) if reports else 0.0,
+        "blank_sections": sections,
+    }
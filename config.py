@@ -0,0 +1,22 @@
+import os
+import sys
+
+# Configuration lookup shared by the CLI and the app.
+#
+# Values come from Streamlit secrets (.streamlit/secrets.toml) when running
+# inside the app, otherwise from the environment (.env is loaded by the
+# caller). Streamlit is only consulted when it is already imported, i.e.
+# under `streamlit run`, so the CLI and its worker processes never pay for
+# importing it.
+
+
+def get_env_var(name: str):
+    st = sys.modules.get("streamlit")
+    if st is not None:
+        try:
+            if name in st.secrets:
+                return st.secrets[name]
+        except Exception:
+            # No secrets.toml: fall back to the environment.
+            pass
+    return os.getenv(name)
@@ -0,0 +1,115 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Background extraction jobs.
+#
+# The Streamlit app submits extraction work here instead of running it inside
+# the script run. The UI stays responsive, a rerun or browser refresh does not
+# abandon the work, and finished pages can be reviewed while the rest are
+# still being extracted. Jobs run on a small process-wide thread pool and the
+# app polls their state. Nothing in here touches Streamlit.
+
+# Jobs running at once across all sessions; each one already runs its pages
+# concurrently (LLM_MAX_CONCURRENCY), so this stays small.
+MAX_JOBS = int(os.getenv("EXTRACTION_MAX_JOBS", "2"))
+
+# Finished jobs are forgotten after this long.
+KEEP_FINISHED_S = 3600
+
+QUEUED, RUNNING, DONE, CANCELLED, FAILED = "queued", "running", "done", "cancelled", "failed"
+
+
+@dataclass
+class ExtractionJob:
+    job_id: str
+    pages: list                                  # page numbers, in order
+    status: str = QUEUED
+    results: dict = field(default_factory=dict)  # page_num -> page result
+    failures: list = field(default_factory=list)
+    info: dict = field(default_factory=dict)     # run statistics for the report
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def total(self):
+        return len(self.pages)
+
+    @property
+    def done(self):
+        return len(self.results)
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Stop submitting pages; requests already sent still finish."""
+        self.cancel_event.set()
+
+    def add_result(self, page_num, result):
+        with self.lock:
+            self.results[page_num] = result
+
+    def snapshot(self):
+        """Copy of the finished page results, safe to read while the job runs."""
+        with self.lock:
+            return dict(self.results)
+
+
+class JobManager:
+    def __init__(self, max_jobs=MAX_JOBS, keep_finished_s=KEEP_FINISHED_S):
+        self.pool = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="extraction-job")
+        self.keep_finished_s = keep_finished_s
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, pages, work):
+        """
+        pages -> page numbers the job will extract
+        work  -> callable(job) doing the extraction on a pool thread; it
+                 reports each page with job.add_result and stops taking new
+                 pages once job.cancelled is set
+        """
+        job = ExtractionJob(uuid.uuid4().hex, list(pages))
+        with self.lock:
+            self.prune()
+            self.jobs[job.job_id] = job
+        self.pool.submit(self._run, job, work)
+        return job
+
+    def _run(self, job, work):
+        status = CANCELLED
+        if not job.cancelled:
+            job.status = RUNNING
+            try:
+                work(job)
+                status = CANCELLED if job.cancelled else DONE
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                status = FAILED
+        # finished is set first and under the lock prune() runs under, so a
+        # job that is no longer active always has a finish time.
+        with self.lock:
+            job.finished = time.time()
+            job.status = status
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def prune(self):
+        cutoff = time.time() - self.keep_finished_s
+        for job_id, job in list(self.jobs.items()):
+            if not job.active and job.finished is not None and job.finished < cutoff:
+                del self.jobs[job_id]
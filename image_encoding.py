@@ -0,0 +1,163 @@
+import io
+import os
+import time
+import argparse
+from dataclasses import dataclass
+from typing import Optional
+
+from PIL import Image
+
+# In-memory page encoding.
+#
+# Pages are encoded straight into a BytesIO buffer (no temp files) using an
+# EncodingProfile that decides the payload format, colour mode and size sent
+# to the model. Lossless 150-DPI colour PNGs are large; grayscale JPEG/WebP
+# or bilevel PNG are usually several times smaller for scanned forms.
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    format: str = "PNG"                 # PNG, JPEG or WEBP
+    quality: int = 85                   # JPEG/WebP quality, ignored for PNG
+    mode: Optional[str] = None          # None (keep), "L" (grayscale) or "1" (bilevel)
+    max_long_edge: Optional[int] = None # downscale so the longest side fits
+
+    @property
+    def mime_type(self):
+        return MIME_TYPES[self.format]
+
+@dataclass
+class EncodedPage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    encode_ms: float
+
+    @property
+    def size(self):
+        return len(self.data)
+
+PROFILES = {
+    "png": EncodingProfile("PNG"),
+    "png-gray": EncodingProfile("PNG", mode="L"),
+    "png-bilevel": EncodingProfile("PNG", mode="1"),
+    "jpeg": EncodingProfile("JPEG", quality=85),
+    "jpeg-gray": EncodingProfile("JPEG", quality=80, mode="L"),
+    "jpeg-small": EncodingProfile("JPEG", quality=75, mode="L", max_long_edge=1600),
+    "webp": EncodingProfile("WEBP", quality=80),
+    "webp-gray": EncodingProfile("WEBP", quality=75, mode="L"),
+}
+
+DEFAULT_PROFILE = os.getenv("IMAGE_ENCODING_PROFILE", "png")
+
+
+def get_profile(spec=None):
+    """
+    Resolve a profile by name (see PROFILES) or from an inline spec such as
+    "jpeg:70,gray,max=1800" / "png,bilevel" / "webp:60".
+    """
+    if isinstance(spec, EncodingProfile):
+        return spec
+    spec = (spec or DEFAULT_PROFILE).strip().lower()
+    if spec in PROFILES:
+        return PROFILES[spec]
+
+    head, *options = [part.strip() for part in spec.split(",")]
+    fmt, _, quality = head.partition(":")
+    fmt = {"jpg": "jpeg"}.get(fmt, fmt).upper()
+    if fmt not in MIME_TYPES:
+        raise ValueError(f"Unknown encoding profile: {spec}")
+
+    kwargs = {"format": fmt}
+    if quality:
+        kwargs["quality"] = int(quality)
+    for option in options:
+        if option in ("gray", "grey", "grayscale"):
+            kwargs["mode"] = "L"
+        elif option in ("bilevel", "bw"):
+            kwargs["mode"] = "1"
+        elif option.startswith("max="):
+            kwargs["max_long_edge"] = int(option[4:])
+        else:
+            raise ValueError(f"Unknown encoding option '{option}' in {spec}")
+    return EncodingProfile(**kwargs)
+
+
+def encode_page(image, profile=None):
+    profile = get_profile(profile)
+    start = time.perf_counter()
+
+    if profile.max_long_edge and max(image.size) > profile.max_long_edge:
+        scale = profile.max_long_edge / max(image.size)
+        image = image.resize(
+            (round(image.width * scale), round(image.height * scale)),
+            Image.LANCZOS,
+        )
+
+    if profile.mode == "1":
+        image = image.convert("L").convert("1")
+        # JPEG/WebP have no 1-bit mode; keep the thresholded pixels as 8-bit.
+        if profile.format != "PNG":
+            image = image.convert("L")
+    elif profile.mode:
+        image = image.convert(profile.mode)
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buf = io.BytesIO()
+    if profile.format == "PNG":
+        image.save(buf, "PNG", optimize=profile.mode == "1")
+    else:
+        image.save(buf, profile.format, quality=profile.quality)
+
+    return EncodedPage(
+        data=buf.getvalue(),
+        mime_type=profile.mime_type,
+        width=image.width,
+        height=image.height,
+        encode_ms=(time.perf_counter() - start) * 1000,
+    )
+
+
+def compare_profiles(images, profiles=None):
+    """
+    Encode the same pages with every profile and return one row per profile
+    with the total bytes and encode time, smallest payload first.
+    """
+    rows = []
+    for name in profiles or PROFILES:
+        encoded = [encode_page(image, name) for image in images]
+        total = sum(e.size for e in encoded)
+        rows.append({
+            "profile": name,
+            "pages": len(encoded),
+            "total_bytes": total,
+            "bytes_per_page": total // max(1, len(encoded)),
+            "encode_ms_per_page": sum(e.encode_ms for e in encoded) / max(1, len(encoded)),
+        })
+    return sorted(rows, key=lambda r: r["total_bytes"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare page encoding profiles on a PDF")
+    parser.add_argument("--pdf", required=True, help="Path to input PDF")
+    parser.add_argument("--dpi", type=int, default=150, help="Rasterization resolution")
+    parser.add_argument("--profiles", nargs="*", help="Profile names/specs (default: all)")
+    args = parser.parse_args()
+
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(args.pdf, dpi=args.dpi)
+    print(f"{'profile':<24}{'KiB/page':>10}{'ms/page':>10}")
+    for row in compare_profiles(images, args.profiles):
+        print(f"{row['profile']:<24}{row['bytes_per_page'] / 1024:>10.0f}"
+              f"{row['encode_ms_per_page']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
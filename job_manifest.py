@@ -0,0 +1,115 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+
+# Checkpoints for resumable extraction runs.
+#
+# Layout of a job directory:
+#   manifest.json                 run settings (schema, dpi, encoding, ...)
+#   pages/<doc_id>/page_0007.json one file per finished page
+#   docs/<doc_id>.json            merged result once a document is complete
+#   failures/<doc_id>.json        failure records of pages that could not be extracted
+#
+# Every file is written atomically (temp file + os.replace), so a crash or
+# kill never leaves a half-written checkpoint behind.
+
+# Subdirectories a job owns (removed when it is restarted).
+JOB_SUBDIRS = ("pages", "docs", "failures")
+
+
+def atomic_write_json(path, data, indent=None):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class JobManifest:
+    def __init__(self, job_dir, settings=None, resume=False):
+        """
+        Open (or start) the job in `job_dir`.
+
+        settings -> dict describing the run; on resume it must match the
+                    stored settings, otherwise pages from a different schema
+                    or resolution would be mixed into the output
+        resume   -> keep existing checkpoints; without it the job is restarted
+        """
+        self.job_dir = Path(job_dir)
+        self.settings = settings or {}
+        manifest_path = self.job_dir / "manifest.json"
+
+        if resume and manifest_path.exists():
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("settings") != self.settings:
+                raise RuntimeError(
+                    f"Job in {self.job_dir} was started with different settings "
+                    f"({stored.get('settings')}); rerun without --resume to restart it."
+                )
+        else:
+            self._clear(manifest_path)
+            atomic_write_json(manifest_path, {"settings": self.settings}, indent=2)
+
+    def _clear(self, manifest_path):
+        # Restarting removes only what a job writes. A non-empty directory
+        # without a manifest is not a job directory and is left alone.
+        if not self.job_dir.is_dir():
+            return
+        if not manifest_path.exists() and any(self.job_dir.iterdir()):
+            raise RuntimeError(
+                f"{self.job_dir} is not empty and holds no job manifest; "
+                f"choose another --job-dir."
+            )
+        for name in JOB_SUBDIRS:
+            shutil.rmtree(self.job_dir / name, ignore_errors=True)
+        manifest_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def doc_id(pdf_path):
+        path = Path(pdf_path)
+        digest = hashlib.sha1(str(path.resolve()).encode("utf-8")).hexdigest()[:10]
+        return f"{path.stem}-{digest}"
+
+    def _page_dir(self, pdf_path):
+        return self.job_dir / "pages" / self.doc_id(pdf_path)
+
+    def _doc_path(self, pdf_path):
+        return self.job_dir / "docs" / f"{self.doc_id(pdf_path)}.json"
+
+    def completed_pages(self, pdf_path):
+        pages = {}
+        page_dir = self._page_dir(pdf_path)
+        if page_dir.is_dir():
+            for path in page_dir.glob("page_*.json"):
+                with open(path, "r", encoding="utf-8") as f:
+                    pages[int(path.stem.split("_")[1])] = json.load(f)
+        return pages
+
+    def save_page(self, pdf_path, page_num, result):
+        atomic_write_json(self._page_dir(pdf_path) / f"page_{page_num:04d}.json", result)
+
+    def is_document_done(self, pdf_path):
+        return self._doc_path(pdf_path).exists()
+
+    def document_result(self, pdf_path):
+        with open(self._doc_path(pdf_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def mark_document_done(self, pdf_path, result):
+        atomic_write_json(self._doc_path(pdf_path), result)
+
+    def save_failures(self, pdf_path, failures):
+        path = self.job_dir / "failures" / f"{self.doc_id(pdf_path)}.json"
+        atomic_write_json(path, sorted(failures, key=lambda r: r.get("page", 0)), indent=2)
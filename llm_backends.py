@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import re
+import random
+import hashlib
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+from schema_compiler import compact_schema
+
+# Offline LLM backends for profiling and CI.
+#
+# Each backend exposes the same call LLMHandler makes on a provider model:
+#     generate_content(contents, generation_config=None, request_options=None)
+# returning an object with `.text` and `.usage_metadata`, so the rest of the
+# pipeline (rasterization, encoding, merge, review, export) runs unchanged.
+#
+#   RecordingBackend  wraps a real model and saves every response + latency
+#   ReplayBackend     serves recorded responses with recorded or zero latency
+#   SyntheticBackend  invents schema-conformant JSON with configurable latency
+#                     and injected errors, no network or API key needed
+#
+# Selected with LLM_BACKEND=gemini|record|replay|synthetic (see LLMHandler).
+
+DEFAULT_RECORD_DIR = os.getenv("LLM_RECORD_DIR", ".recordings")
+BASE_DIR = Path(__file__).resolve().parent
+SCHEMA_PATHS = sorted(BASE_DIR.glob("schemas/*.json")) + [BASE_DIR / "ocr_schema.json"]
+
+
+def _response(text, prompt_tokens, response_tokens):
+    return SimpleNamespace(
+        text=text,
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=response_tokens,
+            total_token_count=prompt_tokens + response_tokens,
+        ),
+    )
+
+def _parts(contents):
+    for message in contents:
+        yield from message.get("parts", [])
+
+def request_key(contents, generation_config=None):
+    """Stable hash of a request: every text part, image payload and config."""
+    h = hashlib.sha256()
+    for part in _parts(contents):
+        if "text" in part:
+            data = part["text"].encode("utf-8")
+        else:
+            data = part.get("mime_type", "").encode("utf-8") + bytes(part.get("data", b""))
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    h.update(json.dumps(generation_config or {}, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class RecordingBackend:
+    def __init__(self, model, record_dir=DEFAULT_RECORD_DIR):
+        self.model = model
+        self.record_dir = Path(record_dir)
+        self.record_dir.mkdir(parents=True, exist_ok=True)
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        start = time.perf_counter()
+        response = self.model.generate_content(
+            contents, generation_config=generation_config, request_options=request_options,
+        )
+        latency = time.perf_counter() - start
+        meta = getattr(response, "usage_metadata", None)
+
+        record = {
+            "text": getattr(response, "text", str(response)),
+            "latency_s": latency,
+            "prompt_tokens": getattr(meta, "prompt_token_count", None) or 0,
+            "response_tokens": getattr(meta, "candidates_token_count", None) or 0,
+        }
+        path = self.record_dir / f"{request_key(contents, generation_config)}.json"
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(record, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        return response
+
+
+class ReplayBackend:
+    def __init__(self, record_dir=DEFAULT_RECORD_DIR, latency="recorded"):
+        """
+        latency -> "recorded" sleeps for the latency seen when recording,
+                   "zero" answers immediately, a number scales the recorded
+                   latency (0.5 = twice as fast)
+        """
+        self.record_dir = Path(record_dir)
+        self.latency = latency
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        path = self.record_dir / f"{request_key(contents, generation_config)}.json"
+        if not path.exists():
+            raise LookupError(f"No recorded response for this request in {self.record_dir}")
+        record = json.loads(path.read_text(encoding="utf-8"))
+
+        if self.latency != "zero":
+            scale = 1.0 if self.latency == "recorded" else float(self.latency)
+            time.sleep(record.get("latency_s", 0) * scale)
+        return _response(record["text"], record["prompt_tokens"], record["response_tokens"])
+
+
+# Markers of a batched request: per-page labels and the schema listing.
+BATCH_LABEL = re.compile(r'Page key "(page_\d+)".*schema (S\d+)')
+SCHEMA_HEADER = re.compile(r"^### Schema (S\d+)\n", re.M)
+
+
+class SyntheticError(RuntimeError):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+class SyntheticBackend:
+    # Injected failures, in the shape of real provider errors.
+    ERRORS = [
+        ("429 Resource has been exhausted (e.g. check quota).", 429),
+        ("503 The service is currently unavailable.", 503),
+        ("504 Deadline Exceeded", 504),
+    ]
+
+    def __init__(self, schema_paths=SCHEMA_PATHS, latency_ms=800.0, latency_jitter=0.3,
+                 error_rate=0.0, malformed_rate=0.0, fill_rate=0.6, seed=0):
+        """
+        latency_ms      -> mean simulated latency per call
+        latency_jitter  -> +/- fraction applied uniformly around the mean
+        error_rate      -> probability a call raises a rate-limit/server/timeout error
+        malformed_rate  -> probability the JSON text comes back truncated
+        fill_rate       -> probability a leaf field gets a value instead of null
+        seed            -> outputs are deterministic per (seed, request)
+        """
+        self.latency_ms = latency_ms
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.fill_rate = fill_rate
+        self.seed = seed
+        self._calls = 0
+        self._lock = threading.Lock()
+
+        # Recognise which schema a prompt carries by any of its renderings.
+        self.schemas = []
+        for path in schema_paths:
+            if not Path(path).exists():
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                schema = json.load(f)
+            renderings = (
+                compact_schema(schema),
+                json.dumps(schema, indent=2, ensure_ascii=False),
+                json.dumps(schema, ensure_ascii=False),
+                json.dumps(schema),
+            )
+            self.schemas.append((renderings, schema))
+        # Larger schemas first, so a schema never matches inside a bigger one.
+        self.schemas.sort(key=lambda entry: -len(entry[0][0]))
+
+    def find_schema(self, text):
+        for renderings, schema in self.schemas:
+            if any(r in text for r in renderings):
+                return schema
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+        # Prompts carrying only some sections of a known schema (blank
+        # sections left out): keep the sections whose names appear.
+        best = {}
+        for _, schema in self.schemas:
+            present = {k: v for k, v in schema.get("properties", {}).items() if k in text}
+            if len(present) > len(best.get("properties", {})):
+                best = dict(schema, properties=present)
+        return best
+
+    def batch_schemas(self, texts):
+        """{page key: schema} for a batched request (see ocr_extractor.build_batch_text)."""
+        labels = [BATCH_LABEL.match(t) for t in texts[1:]]
+        if not texts or not any(labels):
+            return {}
+        parts = SCHEMA_HEADER.split(texts[0])
+        bodies = dict(zip(parts[1::2], parts[2::2]))
+        return {
+            m.group(1): self.find_schema(bodies.get(m.group(2), ""))
+            for m in labels if m
+        }
+
+    @staticmethod
+    def fake_text(name, rng):
+        # Plausible handwriting for the kind of field, judged by its name.
+        name = name.lower()
+        if "date" in name or "birth" in name:
+            return f"{rng.randint(1950, 2020)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        if "phone" in name:
+            return f"+1602555{rng.randint(0, 9999):04d}"
+        if "email" in name:
+            return rng.choice(["jsmith@example.com", "maria.g@example.org"])
+        if "zip" in name:
+            return f"85{rng.randint(0, 999):03d}"
+        if "name" in name or "contact" in name:
+            return rng.choice(["John Smith", "Maria Garcia", "Lee Chen", "Ana Lopez"])
+        return rng.choice(["Phoenix", "N/A", "see notes", "twice a week", "none known"])
+
+    def fake_value(self, node, rng, name=""):
+        node_type = node.get("type")
+        items = node.get("items") or {}
+
+        if node.get("properties") is not None:
+            return {
+                key: self.fake_value(sub, rng, key)
+                for key, sub in node["properties"].items()
+                if isinstance(sub, dict)
+            }
+        if node_type == "array":
+            if items.get("enum"):
+                return rng.sample(items["enum"], rng.randint(0, min(2, len(items["enum"]))))
+            if items.get("properties") is not None:
+                return [self.fake_value(items, rng, name) for _ in range(rng.randint(0, 2))]
+            return [f"item {i + 1}" for i in range(rng.randint(0, 2))]
+        if rng.random() > self.fill_rate:
+            return None
+        if node.get("enum"):
+            return rng.choice(node["enum"])
+        if node_type == "boolean":
+            return rng.random() < 0.5
+        if node_type in ("integer", "number"):
+            return rng.randint(0, 99)
+        return self.fake_text(name, rng)
+
+    def generate_content(self, contents, generation_config=None, request_options=None):
+        texts = [p["text"] for p in _parts(contents) if "text" in p]
+        key = request_key(contents, generation_config)
+        rng = random.Random(f"{self.seed}:{key}")
+
+        with self._lock:
+            self._calls += 1
+            call_rng = random.Random(f"{self.seed}:{key}:{self._calls}")
+
+        latency = self.latency_ms * (1 + call_rng.uniform(-self.latency_jitter, self.latency_jitter))
+        time.sleep(max(0.0, latency) / 1000)
+
+        if call_rng.random() < self.error_rate:
+            message, code = call_rng.choice(self.ERRORS)
+            raise SyntheticError(message, code)
+
+        batch = self.batch_schemas(texts)
+        if batch:
+            data = {key: self.fake_value(schema, rng) for key, schema in batch.items()}
+        else:
+            data = self.fake_value(self.find_schema(texts[0] if texts else ""), rng)
+        text = json.dumps(data, ensure_ascii=False)
+        if call_rng.random() < self.malformed_rate:
+            text = text[: max(1, int(len(text) * 0.9))]
+
+        prompt_tokens = sum(len(t) for t in texts) // 4 + 258
+        return _response(text, prompt_tokens, len(text) // 4)
+
+
+def make_offline_backend(kind, env=os.getenv):
+    """Build the replay/synthetic backend named by LLM_BACKEND from env settings."""
+    if kind == "replay":
+        return ReplayBackend(
+            env("LLM_RECORD_DIR") or DEFAULT_RECORD_DIR,
+            latency=env("LLM_REPLAY_LATENCY") or "recorded",
+        )
+    if kind == "synthetic":
+        return SyntheticBackend(
+            latency_ms=float(env("LLM_SYNTHETIC_LATENCY_MS") or 800),
+            error_rate=float(env("LLM_SYNTHETIC_ERROR_RATE") or 0),
+            malformed_rate=float(env("LLM_SYNTHETIC_MALFORMED_RATE") or 0),
+            seed=int(env("LLM_SYNTHETIC_SEED") or 0),
+        )
+    raise ValueError(f"Unknown offline LLM backend: {kind}")
@@ -1,17 +1,24 @@
-import os
 import json
-import streamlit as st
+import time
+import threading
 from dotenv import load_dotenv
-from json_repair import repair_json
-import google.generativeai as genai
+from config import get_env_var
+from llm_backends import RecordingBackend, DEFAULT_RECORD_DIR, make_offline_backend
+import pipeline_metrics
 
-
-def get_env_var(name: str):
-    if name in st.secrets:
-        return st.secrets[name]
-    return os.getenv(name)
+# Provider SDKs are imported where the model is configured, not at module
+# load: google.generativeai alone takes most of a second to import, and
+# offline backends (replay, synthetic) never need it.
 
 class LLMHandler:
+    # Sampling settings sent with every request. Also part of the page cache
+    # key, so changing them invalidates cached results.
+    generation_config = {
+        "temperature": 0.1,
+        "top_p": 0.9,
+        "response_mime_type": "application/json",
+    }
+
     def __init__(self):
         """
         Initialize the LLM using environment variables.
@@ -21,10 +28,25 @@ class LLMHandler:
             LLM_API_KEY_ENV      -> name of the env variable that stores API key
         Optional (user-defined):
             Any other vars needed for your chosen provider (e.g., API base URL)
+            LLM_BACKEND          -> gemini (default), record, replay or synthetic;
+                                    replay/synthetic need no API key (llm_backends.py)
         """
 
         load_dotenv()
 
+        # Running token totals over the successful calls (see usage_summary).
+        self.usage = {"calls": 0, "prompt_tokens": 0, "response_tokens": 0}
+        self._usage_lock = threading.Lock()
+
+        backend = (get_env_var("LLM_BACKEND") or "gemini").lower()
+        if backend in ("replay", "synthetic"):
+            # The backend is part of the name (and so of the page cache key):
+            # offline answers must never be served to a real model's run.
+            name = get_env_var("LLM_MODEL_NAME")
+            self.model_name = f"{backend}:{name}" if name else backend
+            self.model = make_offline_backend(backend, get_env_var)
+            return
+
         self.model_name = get_env_var("LLM_MODEL_NAME")
         self.api_key = get_env_var("LLM_API_KEY_ENV")
 
@@ -40,6 +62,7 @@ class LLMHandler:
         # Import and initialize your model explicitly here.
         #
         # Example for Google Gemini:
+        import google.generativeai as genai
         genai.configure(api_key=self.api_key)
         self.model = genai.GenerativeModel(self.model_name)
         #
@@ -57,33 +80,94 @@ class LLMHandler:
         #     according to their chosen provider.
         # -------------------------------------------------------------
 
-    def generate_json(self, schema_text, page_prompt, image_bytes):
+        if backend == "record":
+            self.model = RecordingBackend(
+                self.model, get_env_var("LLM_RECORD_DIR") or DEFAULT_RECORD_DIR
+            )
+
+    def generate_json(self, schema_text, page_prompt, image_bytes, mime_type="image/png",
+                      tag=None):
+        return self._generate([
+            {"text": schema_text},
+            {"text": page_prompt},
+            {"mime_type": mime_type, "data": image_bytes}
+        ], tag)
+
+    def generate_json_batch(self, schema_text, pages, tag=None):
+        """
+        Several pages in one request.
+
+        pages -> list of (label_text, image_bytes, mime_type); each label
+                 introduces the image after it (page key and schema)
+
+        Returns the parsed JSON object, expected to be keyed by page.
+        """
+        parts = [{"text": schema_text}]
+        for label, image_bytes, mime_type in pages:
+            parts.append({"text": label})
+            parts.append({"mime_type": mime_type, "data": image_bytes})
+        return self._generate(parts, tag)
+
+    def _generate(self, parts, tag):
+        start = time.perf_counter()
+        usage = {}
+        repaired = failed = 0
         try:
             response = self.model.generate_content(
                 [
-                    {"role": "user", "parts": [
-                        {"text": schema_text},
-                        {"text": page_prompt},
-                        {"mime_type": "image/png", "data": image_bytes}
-                    ]}
+                    {"role": "user", "parts": parts}
                 ],
-                generation_config={
-                    "temperature": 0.1,
-                    "top_p": 0.9,
-                    "response_mime_type": "application/json",
-                },
+                generation_config=self.generation_config,
                 request_options={"timeout": 180}
             )
 
+            usage = self._record_usage(response, tag)
+
             text_output = getattr(response, "text", str(response))
             try:
                 return json.loads(text_output)
             except json.JSONDecodeError:
-                start, end = text_output.find("{"), text_output.rfind("}")
-                if start != -1 and end != -1:
-                    candidate = text_output[start:end + 1]
+                start_brace, end_brace = text_output.find("{"), text_output.rfind("}")
+                if start_brace != -1 and end_brace != -1:
+                    from json_repair import repair_json
+                    candidate = text_output[start_brace:end_brace + 1]
+                    repaired = 1
                     return json.loads(repair_json(candidate))
                 raise
 
         except Exception as e:
-            raise RuntimeError(f"LLM generation failed: {e}")
+            failed = 1
+            raise RuntimeError(f"LLM generation failed: {e}") from e
+        finally:
+            pipeline_metrics.record(
+                "llm", (time.perf_counter() - start) * 1000, tag=tag, model=self.model_name,
+                prompt_tokens=usage.get("prompt_tokens"), response_tokens=usage.get("response_tokens"),
+                repaired=repaired, failed=failed,
+            )
+
+    def _record_usage(self, response, tag):
+        meta = getattr(response, "usage_metadata", None)
+        usage = {
+            "tag": tag,
+            "prompt_tokens": getattr(meta, "prompt_token_count", None),
+            "response_tokens": getattr(meta, "candidates_token_count", None),
+            "total_tokens": getattr(meta, "total_token_count", None),
+        }
+        with self._usage_lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += usage["prompt_tokens"] or 0
+            self.usage["response_tokens"] += usage["response_tokens"] or 0
+        return usage
+
+    def usage_summary(self, since=None):
+        """
+        Token totals so far, or since an earlier usage_summary() result
+        passed as `since` (e.g. for one run).
+        """
+        with self._usage_lock:
+            totals = dict(self.usage)
+        if since:
+            totals = {key: value - since.get(key, 0) for key, value in totals.items()}
+        calls = totals["calls"]
+        totals["prompt_tokens_per_call"] = totals["prompt_tokens"] / calls if calls else 0
+        return totals
@@ -1,13 +1,50 @@
 import os
+import sys
+import glob
 import json
-import time
 import argparse
+import queue
+import threading
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED,
+)
 from pathlib import Path
 from dotenv import load_dotenv
-from pdf2image import convert_from_path
-import tempfile
 from llm_handler import LLMHandler
+from pdf_pages import (
+    DEFAULT_DPI, RENDER_CONFIG, RenderSettings, pdf_page_count, iter_pdf_pages,
+    iter_rendered_pages, prepare_page, render_page, load_render_plan,
+)
+from image_encoding import get_profile, encode_page, DEFAULT_PROFILE
+from page_cache import PageCache, DEFAULT_CACHE_PATH, make_cache_key
+from job_manifest import JobManifest, atomic_write_json
+from page_templates import TEMPLATE_DIR, crop_sections
+from schema_compiler import compact_schema, schema_field_paths
+from result_sink import JsonlSink, ParquetSink, MultiSink
+from schema_validator import validator_for, sub_schema, get_path, set_path
+from blank_detection import BlankDetector, skip_summary
+import pipeline_metrics
+from pipeline_metrics import PipelineMetrics, carry_context, record_prepared
+from page_classifier import PageClassifier
+from request_scheduler import (
+    RequestScheduler, RequestFailed, DEFAULT_RPM, DEFAULT_TPM,
+    estimate_tokens, get_default_scheduler,
+)
+
+# Pages sent together in one request (batched mode). 1 sends one page per
+# request; larger values save per-request overhead on short pages.
+DEFAULT_BATCH_PAGES = int(os.getenv("LLM_BATCH_PAGES", "1"))
 
+# Refinement pass: pages with more empty or invalid fields than this are left
+# alone (a mostly empty page is usually just sparsely filled in, and asking
+# for most of its fields again costs as much as a full retry).
+DEFAULT_REFINE_MAX_FIELDS = int(os.getenv("REFINE_MAX_FIELDS", "25"))
+
+# Maximum number of page requests in flight at once. LLM calls are network
+# bound, so a small thread pool brings the wall-clock time of a packet close
+# to its slowest page instead of the sum of all pages.
+DEFAULT_MAX_WORKERS = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
 
 # SYSTEM_INSTRUCTIONS = """
 # You are an expert OCR and form-understanding assistant.
@@ -33,7 +70,7 @@ You are an expert OCR and form-understanding assistant.
 {schema}
 
 You will be given:
-1) A JSON schema that defines FIELD NAMES and NESTING ONLY
+1) A schema (field outline) that defines FIELD NAMES and NESTING ONLY
 2) An image of a scanned, filled PDF form
 
 CRITICAL RULES (NON-NEGOTIABLE):
@@ -66,36 +103,867 @@ CRITICAL RULES (NON-NEGOTIABLE):
    Do not invent new fields.
    Do not omit fields.
 
-8. Formatting rules:
-   Dates → YYYY-MM-DD (if clearly present)
-   Phone numbers → E.164 format (if clearly present)
-   Otherwise, return the raw visible value.
+8. Write dates, phone numbers and other values exactly as they appear;
+   they are normalized after extraction.
 
 Return STRICTLY valid JSON.
 No comments. No explanations. No extra text.
 """
 
-def extract_page_json(llm, page_image, page_num, schema_text):
-    print(f"Processing page {page_num} ...")
+BATCH_INSTRUCTIONS = """
+BATCHED PAGES:
+This request contains SEVERAL pages. Each image is preceded by a line giving
+its page key (e.g. "page_3") and the schema (S1, S2, ...) it follows.
+Apply all rules above to every page separately.
+Return ONE JSON object whose keys are the page keys and whose values are the
+data of that page. Include every page key exactly once.
+"""
+
+def build_schema_text(schema, schema_format="compact"):
+    """
+    System prompt for a schema. "compact" sends the field outline from
+    schema_compiler (far fewer input tokens per page); "json" sends the
+    pretty-printed JSON schema as before.
+    """
+    if schema_format == "json":
+        rendered = json.dumps(schema, indent=2, ensure_ascii=False)
+    else:
+        rendered = compact_schema(schema)
+    return SYSTEM_INSTRUCTIONS.format(schema=rendered)
+
+def schema_body(schema_text):
+    """The schema rendering inside a build_schema_text prompt."""
+    prefix, suffix = SYSTEM_INSTRUCTIONS.split("{schema}")
+    if schema_text.startswith(prefix) and schema_text.endswith(suffix):
+        return schema_text[len(prefix):len(schema_text) - len(suffix)]
+    return schema_text
+
+def build_batch_text(schema_texts):
+    """System prompt for a batched request; schema_texts are the distinct page prompts."""
+    listing = "\n\n".join(
+        f"### Schema S{i}\n{schema_body(text)}" for i, text in enumerate(schema_texts, 1)
+    )
+    return SYSTEM_INSTRUCTIONS.format(schema=listing) + BATCH_INSTRUCTIONS
 
+def page_prompt_for(page_num, section=None):
     page_prompt = f"""
 This is page {page_num} of a multi page form.
 Extract only the handwritten or user entered responses visible on this page.
 Return valid JSON according to the provided schema.
 """
+    if section:
+        page_prompt += f"The image is a crop showing only the {section} section of the page.\n"
+    return page_prompt
+
+def page_cache_key(llm, page_image, schema_text, page_prompt):
+    return make_cache_key(
+        page_image, schema_text, page_prompt,
+        llm.model_name, llm.generation_config,
+    )
+
+def conform_result(llm, result, schema, page_num, page_image, mime_type="image/png",
+                   scheduler=None, section=None, schema_format="compact"):
+    """
+    Check and coerce an answer against its schema (schema_validator). The
+    subtrees that do not conform are asked for again, once, with a schema of
+    just those fields, and merged back.
+
+    Returns (result, errors left over as [(path, message)]).
+    """
+    validation = validator_for(schema).validate(result)
+    if validation.ok:
+        return validation.value, []
+
+    value = validation.value
+    paths = validation.failing_paths()
+    suffix = f" ({section})" if section else ""
+    label, where = f"Page {page_num}{suffix}", f"page {page_num}{suffix} (re-ask)"
+    print(f"{label}: re-asking {len(paths)} field(s) that did not validate: {', '.join(paths)}")
+
+    partial = sub_schema(schema, paths)
+    text = build_schema_text(partial, schema_format)
+    page_prompt = page_prompt_for(page_num, section)
+    scheduler = scheduler or get_default_scheduler()
+    try:
+        answer = scheduler.call(
+            llm.generate_json, text, page_prompt, page_image, mime_type,
+            est_tokens=estimate_tokens(text, page_prompt), label=label, tag=where,
+        )
+    except RequestFailed as e:
+        print(f"{label}: re-ask failed ({e}); keeping the first answer")
+        return value, validation.errors
+
+    again = validator_for(partial).validate(answer)
+    still_bad = again.failing_paths()
+
+    def unresolved(path):
+        return any(path == bad or path.startswith(bad + ".") or bad.startswith(path + ".")
+                   for bad in still_bad)
+
+    for path in paths:
+        if not unresolved(path):
+            set_path(value, path, get_path(again.value, path))
+    return value, [(path, message) for path, message in validation.errors
+                   if unresolved(path.split("[", 1)[0])]
+
+def extract_page_json(llm, page_image, page_num, schema_text, cache=None,
+                      mime_type="image/png", scheduler=None, failures=None, section=None,
+                      schema=None, schema_format="compact"):
+    """
+    Extract one page, or one cropped `section` of it. Requests go through the
+    shared RequestScheduler (rate limits, retries, circuit breaker). If the
+    page still fails, a failure record is appended to `failures` and an empty
+    dict is returned so the rest of the document can be merged.
+
+    schema -> optional schema dict; the answer is validated and coerced
+              against it and non-conforming subtrees are re-asked
+              (conform_result). For a section, the schema with only that
+              section; the answer is returned wrapped in the section key.
+    """
+    page_prompt = page_prompt_for(page_num, section)
+    suffix = f" ({section})" if section else ""
+    label, where = f"Page {page_num}{suffix}", f"page {page_num}{suffix}"
+
+    cache_key = None
+    if cache is not None:
+        cache_key = page_cache_key(llm, page_image, schema_text, page_prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"{label}: cache hit")
+            return cached
+
+    print(f"Processing {where} ...")
+    scheduler = scheduler or get_default_scheduler()
+
+    try:
+        result = scheduler.call(
+            llm.generate_json, schema_text, page_prompt, page_image, mime_type,
+            est_tokens=estimate_tokens(schema_text, page_prompt),
+            label=label, tag=where,
+        )
+    except RequestFailed as e:
+        print(f"Skipping {where}: {e}")
+        if failures is not None:
+            record = e.record(page=page_num)
+            if section:
+                record["section"] = section
+            failures.append(record)
+        return {}
+
+    if schema is not None and isinstance(result, dict) and result:
+        # The model may or may not wrap a section's answer in its key.
+        if section and set(result) != {section}:
+            result = {section: result}
+        result, errors = conform_result(
+            llm, result, schema, page_num, page_image, mime_type, scheduler,
+            section, schema_format,
+        )
+        for path, message in errors:
+            print(f"{label}: {path}: {message}")
+
+    if cache is not None and result:
+        cache.put(cache_key, result)
+    return result
+
+def valid_page_result(result, schema=None):
+    """A batched page answer is usable: a non-empty object shaped like the schema's top level."""
+    if not isinstance(result, dict) or not result:
+        return False
+    properties = (schema or {}).get("properties")
+    if properties:
+        return set(result) <= set(properties)
+    return True
+
+def extract_batch_json(llm, entries, cache=None, scheduler=None, schema_format="compact"):
+    """
+    Extract several whole pages with one request.
+
+    entries -> list of (page_num, payload, schema_text, schema or None)
+
+    Returns {page_num: result} for the pages whose part of the answer passed
+    valid_page_result (then conformed to their schema, see conform_result);
+    the caller extracts the others one by one. A failed request returns only
+    cached pages.
+    """
+    results = {}
+    todo = []
+    for page_num, payload, text, schema in entries:
+        image = getattr(payload, "data", payload)
+        key = None
+        if cache is not None:
+            key = page_cache_key(llm, image, text, page_prompt_for(page_num))
+            cached = cache.get(key)
+            if cached is not None:
+                print(f"Page {page_num}: cache hit")
+                results[page_num] = cached
+                continue
+        todo.append((page_num, payload, text, schema, key))
+    if len(todo) < 2:
+        return results
+
+    texts = list(dict.fromkeys(text for _, _, text, _, _ in todo))
+    batch_text = build_batch_text(texts)
+    pages = [
+        (f'Page key "page_{page_num}" (page {page_num} of the form), schema S{texts.index(text) + 1}:',
+         getattr(payload, "data", payload), getattr(payload, "mime_type", "image/png"))
+        for page_num, payload, text, _, _ in todo
+    ]
+    nums = ", ".join(str(entry[0]) for entry in todo)
+    print(f"Processing pages {nums} in one request ...")
+    scheduler = scheduler or get_default_scheduler()
+
+    try:
+        answer = scheduler.call(
+            llm.generate_json_batch, batch_text, pages,
+            est_tokens=estimate_tokens(batch_text, *(label for label, _, _ in pages),
+                                       images=len(pages)),
+            label=f"Pages {nums}", tag=f"pages {nums}",
+        )
+    except RequestFailed as e:
+        print(f"Batch of pages {nums} failed ({e}); extracting them one by one")
+        return results
+
+    answer = answer if isinstance(answer, dict) else {}
+    for page_num, payload, _, schema, key in todo:
+        result = answer.get(f"page_{page_num}")
+        if not valid_page_result(result, schema):
+            print(f"Page {page_num}: batched answer failed validation; retrying alone")
+            continue
+        if schema is not None:
+            result, errors = conform_result(
+                llm, result, schema, page_num, getattr(payload, "data", payload),
+                getattr(payload, "mime_type", "image/png"), scheduler,
+                schema_format=schema_format,
+            )
+            for path, message in errors:
+                print(f"Page {page_num}: {path}: {message}")
+        results[page_num] = result
+        if cache is not None:
+            cache.put(key, result)
+    return results
 
-    for attempt in range(3):
+def prefetch(iterable, maxsize=2):
+    """
+    Run `iterable` on a background thread, buffering at most `maxsize` items.
+
+    Used to overlap rasterization/encoding with in-flight LLM calls: the
+    producer renders the next pages while the pool waits on the model, and
+    the bounded queue keeps peak memory at a few pages.
+    """
+    buffer = queue.Queue(maxsize=max(1, maxsize))
+    done = object()
+    # Set when the consumer stops (finished, raised or dropped the
+    # generator); the producer then stops rendering and lets go of its pages.
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
         try:
-            return llm.generate_json(schema_text, page_prompt, page_image)
+            for item in iterable:
+                if not put(item):
+                    return
         except Exception as e:
-            print(f"Error on page {page_num}: {e}")
-            if attempt < 2:
-                delay = 2 ** attempt
-                print(f"Retrying in {delay}s...")
-                time.sleep(delay)
+            put(e)
+            return
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+        put(done)
+
+    threading.Thread(target=carry_context(produce), daemon=True).start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def extract_pages_concurrent(llm, pages, schema_text, max_workers=None,
+                             on_progress=None, total=None, cache=None,
+                             executor=None, on_result=None, scheduler=None,
+                             failures=None, page_schema=None, schema_format="compact",
+                             batch_pages=1, check_schema=None):
+    """
+    Run extract_page_json over many pages with bounded parallelism.
+
+    pages        -> iterable of (page_num, payload) or (page_num, payload,
+                    BlankReport) as made by pdf_pages.prepare_page; payload is
+                    an EncodedPage, PNG bytes or {section: EncodedPage} crops.
+                    Consumed lazily, so at most max_workers requests are held
+                    by the pool
+    schema_text  -> schema text shared by every page, or a callable
+                    page_num -> schema text
+    on_progress  -> optional callback(done, total, page_num), always invoked
+                    from the calling thread (safe for Streamlit widgets)
+    cache        -> optional PageCache consulted before each LLM call
+    executor     -> optional shared thread pool; its size caps LLM calls across
+                    every document submitting to it (batch mode)
+    on_result    -> optional callback(page_num, result) run in the calling
+                    thread as soon as each page finishes (checkpointing)
+    scheduler    -> RequestScheduler for all calls (process default if None)
+    failures     -> optional list collecting failure records of pages that
+                    could not be extracted
+    page_schema  -> optional callable page_num -> schema dict. Blank pages get
+                    its defaults without a model call, and blank sections are
+                    dropped from the prompt and filled with defaults afterwards.
+                    Section crops are sent in parallel, each with only its
+                    sub-schema, and merged back into one page result.
+                    Without it blank pages yield {}.
+    batch_pages  -> send up to this many whole pages per request
+                    (extract_batch_json); pages whose batched answer fails
+                    validation are retried with a request of their own
+    check_schema -> optional callable page_num -> schema dict that answers
+                    are validated against when page_schema gives none (the
+                    single --schema of a run); answers are always checked
+                    against the page_schema schema otherwise
+
+    Returns the page results in the same order as the input pages.
+    """
+    max_workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+    if total is None and hasattr(pages, "__len__"):
+        total = len(pages)
+
+    order = []
+    results = {}
+    in_flight = {}
+    skipped_sections = {}
+    partial = {}
+    batches = {}
+    batch = []
+    retry = []
+    done_count = 0
+
+    def finish(page_num, result):
+        nonlocal done_count
+        if result and page_num in skipped_sections:
+            result = fill_sections(result, *skipped_sections.pop(page_num))
+        results[page_num] = result
+        if on_result:
+            on_result(page_num, result)
+        done_count += 1
+        if on_progress:
+            on_progress(done_count, total, page_num)
+
+    def collect():
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for fut in done:
+            page_num, section = in_flight.pop(fut)
+            result = fut.result()
+            if fut in batches:
+                for entry in batches.pop(fut):
+                    if entry[0] in result:
+                        finish(entry[0], result[entry[0]])
+                    else:
+                        retry.append(entry)
+                continue
+            if section is None:
+                finish(page_num, result)
+                continue
+            page = partial[page_num]
+            page["left"] -= 1
+            if result:
+                # The model may or may not wrap the answer in the section key.
+                page["result"][section] = result[section] if set(result) == {section} else result
+            if not page["left"]:
+                merged = partial.pop(page_num)["result"]
+                # Sections finish in any order; keep the schema's.
+                finish(page_num, {k: merged[k] for k in page["sections"] if k in merged})
+
+    def submit(page_num, section, payload, text, schema=None):
+        fut = pool.submit(
+            carry_context(extract_page_json, page=page_num, section=section), llm,
+            getattr(payload, "data", payload), page_num, text, cache,
+            getattr(payload, "mime_type", "image/png"), scheduler, failures, section,
+            schema, schema_format,
+        )
+        in_flight[fut] = (page_num, section)
+        if len(in_flight) >= max_workers:
+            collect()
+
+    def flush_batch():
+        entries = list(batch)
+        batch.clear()
+        if len(entries) == 1:
+            page_num, payload, text, schema = entries[0]
+            submit(page_num, None, payload, text, schema)
+            return
+        fut = pool.submit(
+            carry_context(extract_batch_json, pages=[entry[0] for entry in entries]),
+            llm, entries, cache, scheduler, schema_format,
+        )
+        batches[fut] = entries
+        in_flight[fut] = (None, None)
+        if len(in_flight) >= max_workers:
+            collect()
+
+    def submit_retries():
+        while retry:
+            page_num, payload, text, schema = retry.pop(0)
+            submit(page_num, None, payload, text, schema)
+
+    own_pool = executor is None
+    pool = ThreadPoolExecutor(max_workers=max_workers) if own_pool else executor
+    try:
+        for page_num, payload, *rest in pages:
+            report = rest[0] if rest else None
+            schema = page_schema(page_num) if page_schema else None
+            properties = schema.get("properties", {}) if schema else {}
+            order.append(page_num)
+
+            blank = [s for s in (report.blank_sections if report else []) if s in properties]
+            if (report is not None and report.blank) or (blank and len(blank) == len(properties)):
+                finish(page_num, materialize_from_schema(schema) if schema else {})
+                continue
+            if blank:
+                skipped_sections[page_num] = (schema, blank)
+
+            if isinstance(payload, dict):
+                partial[page_num] = {"left": len(payload), "result": {}, "sections": list(payload)}
+                for section, crop in payload.items():
+                    section_schema = only_sections(schema, [section])
+                    text = build_schema_text(section_schema, schema_format)
+                    submit(page_num, section, crop, text, section_schema)
+                continue
+
+            if blank:
+                schema = without_sections(schema, blank)
+                text = build_schema_text(schema, schema_format)
+            else:
+                text = schema_text(page_num) if callable(schema_text) else schema_text
+            if schema is None and check_schema:
+                schema = check_schema(page_num)
+
+            if batch_pages > 1:
+                batch.append((page_num, payload, text, schema))
+                if len(batch) >= batch_pages:
+                    flush_batch()
             else:
-                print(f"Skipping page {page_num} after repeated errors.")
-                return {}
+                submit(page_num, None, payload, text, schema)
+            submit_retries()
+
+        if batch:
+            flush_batch()
+        while in_flight or retry:
+            submit_retries()
+            if in_flight:
+                collect()
+    finally:
+        # Stop a prefetch producer now: a traceback holding the generator
+        # would otherwise keep it rendering into the queue.
+        close = getattr(pages, "close", None)
+        if close is not None:
+            close()
+        if own_pool:
+            pool.shutdown()
+
+    return [results[page_num] for page_num in order]
+
+def timed_pages(pages, **fields):
+    """Pass (page_num, image) pairs through, recording a "render" metrics event for each."""
+    pages = iter(pages)
+    while True:
+        start = time.perf_counter()
+        try:
+            page_num, image = next(pages)
+        except StopIteration:
+            return
+        pipeline_metrics.record("render", (time.perf_counter() - start) * 1000, page=page_num, **fields)
+        yield page_num, image
+
+def refine_paths(result, schema, skip_sections=()):
+    """
+    Dotted paths of the fields worth asking for again in a page result: null
+    leaves and fields failing validation, in schema order. Top-level
+    sections in skip_sections (detected blank) are left out.
+    """
+    validation = validator_for(schema).validate(result)
+    failing = validation.failing_paths()
+    paths = [
+        path for path in schema_field_paths(schema)
+        if path in failing or get_path(validation.value, path) is None
+    ]
+    paths += [path for path in failing if path not in paths]
+    return [path for path in paths if path.split(".", 1)[0] not in skip_sections]
+
+def refine_page(llm, page_num, page_image, result, schema, paths, mime_type="image/png",
+                cache=None, scheduler=None, schema_format="compact"):
+    """
+    Ask again for just `paths` of a page with one request carrying a
+    sub-schema of those fields, and merge the answers that come back filled
+    and valid into `result`. Returns the number of fields recovered.
+    """
+    partial = sub_schema(schema, paths)
+    text = build_schema_text(partial, schema_format)
+    prompt = page_prompt_for(page_num) + (
+        "These fields were empty or unreadable in a first pass. "
+        "Look at them carefully; return null only if they are really blank.\n"
+    )
+    where = f"page {page_num} (refine)"
+
+    answer = cache.get(page_cache_key(llm, page_image, text, prompt)) if cache is not None else None
+    if answer is None:
+        print(f"Refining {where}: {len(paths)} field(s)")
+        try:
+            answer = (scheduler or get_default_scheduler()).call(
+                llm.generate_json, text, prompt, page_image, mime_type,
+                est_tokens=estimate_tokens(text, prompt), label=f"Page {page_num} (refine)", tag=where,
+            )
+        except RequestFailed as e:
+            print(f"Skipping {where}: {e}")
+            return 0
+        if cache is not None and answer:
+            cache.put(page_cache_key(llm, page_image, text, prompt), answer)
+
+    again = validator_for(partial).validate(answer)
+    bad = again.failing_paths()
+    recovered = 0
+    for path in paths:
+        value = get_path(again.value, path)
+        if value is None or value == [] or any(path == b or path.startswith(b + ".") for b in bad):
+            continue
+        set_path(result, path, value)
+        recovered += 1
+    return recovered
+
+def refine_document(llm, pdf_path, results, schema_for, dpi, profile=None, skip=None,
+                    max_fields=DEFAULT_REFINE_MAX_FIELDS, max_workers=None, cache=None,
+                    executor=None, scheduler=None, schema_format="compact", region_for=None):
+    """
+    Field-level re-extraction across a document: collect each page's empty
+    or invalid fields (refine_paths), render those pages again at `dpi`, and
+    refine each with one request (refine_page). Updates `results` in place.
+
+    results    -> {page_num: page result}
+    schema_for -> callable page_num -> schema dict or None
+    dpi, profile -> resolution and encoding profile of the second render,
+                  each a value or a callable page_num -> value
+    skip       -> optional {page_num: [blank top-level sections]}; pages
+                  absent from results are not touched
+    region_for -> optional callable (page_num, paths) -> (box, offset,
+                  shape) or None; the page is cropped to that box (page
+                  fractions, aligned as in page_templates.crop_sections)
+
+    Returns {page_num: fields recovered} for the pages that were refined.
+    """
+    def resolve(setting, page_num):
+        return setting(page_num) if callable(setting) else setting
+
+    skip = skip or {}
+    plan = {}
+    for page_num, result in results.items():
+        schema = schema_for(page_num)
+        if not schema or not isinstance(result, dict) or not result:
+            continue
+        paths = refine_paths(result, schema, skip.get(page_num, ()))
+        if paths and len(paths) <= max_fields:
+            plan[page_num] = (schema, paths)
+    if not plan:
+        return {}
+
+    max_workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+    own_pool = executor is None
+    pool = ThreadPoolExecutor(max_workers=max_workers) if own_pool else executor
+    futures = {}
+    by_dpi = {}
+    for page_num in sorted(plan):
+        by_dpi.setdefault(resolve(dpi, page_num), []).append(page_num)
+    try:
+        for page_num, image in (
+            page
+            for page_dpi, nums in by_dpi.items()
+            for page in timed_pages(iter_pdf_pages(pdf_path, dpi=page_dpi, pages=nums),
+                                    pdf=str(pdf_path), refine=1)
+        ):
+            schema, paths = plan[page_num]
+            region = region_for(page_num, paths) if region_for else None
+            if region is not None:
+                box, offset, shape = region
+                image = crop_sections(image, {"refine": box}, offset, shape)["refine"]
+            encoded = encode_page(image, resolve(profile, page_num))
+            pipeline_metrics.record("encode", encoded.encode_ms, pdf=str(pdf_path), page=page_num,
+                                    bytes=encoded.size, mime=encoded.mime_type, refine=1,
+                                    cropped=int(region is not None))
+            futures[pool.submit(
+                carry_context(refine_page, page=page_num, refine=1),
+                llm, page_num, encoded.data, results[page_num], schema, paths,
+                encoded.mime_type, cache, scheduler, schema_format,
+            )] = page_num
+        recovered = {futures[fut]: fut.result() for fut in as_completed(futures)}
+    finally:
+        if own_pool:
+            pool.shutdown()
+    asked = sum(len(paths) for _, paths in plan.values())
+    print(f"{pdf_path}: refined {len(plan)} page(s), {sum(recovered.values())}/{asked} fields recovered")
+    return recovered
+
+def extract_document(llm, pdf_path, schema_text, dpi=DEFAULT_DPI, profile=None,
+                     max_workers=None, cache=None, renderer=None, executor=None,
+                     on_progress=None, encode_log=None, manifest=None,
+                     scheduler=None, failures=None, detector=None, blank_log=None,
+                     page_schemas=None, schema_format="compact", crop=False,
+                     classifier=None, batch_pages=1, sink=None, schema=None,
+                     refine=False, refine_dpi=None, refine_max_fields=DEFAULT_REFINE_MAX_FIELDS,
+                     render_plan=None, progressive_dpi=None):
+    """
+    Rasterize, encode and extract one PDF. Returns page results in page order.
+
+    schema_text -> schema text for every page, or a callable schema_num ->
+                   schema text (schema_num as routed by the classifier, else
+                   the page number)
+    renderer    -> optional ProcessPoolExecutor for rendering/encoding; by
+                   default pages are rendered on a producer thread
+    executor    -> optional shared LLM thread pool (see extract_pages_concurrent)
+    encode_log  -> optional list that receives every EncodedPage for reporting
+    manifest    -> optional JobManifest; finished pages are checkpointed as
+                   they complete and pages already checkpointed are not
+                   rendered or sent again
+    detector    -> optional blank_detection.BlankDetector; blank pages are
+                   never encoded or sent to the model
+    blank_log   -> optional list that receives every BlankReport
+    page_schemas -> optional {schema_num: schema dict}; enables schema
+                   defaults for blank pages/sections (see extract_pages_concurrent)
+    crop        -> send each top-level schema section as its own crop of the
+                   aligned page (needs detector, page_schemas and section
+                   boxes in templates/sections.json)
+    classifier  -> optional page_classifier.PageClassifier routing each page
+                   to its schema by layout instead of by position
+    batch_pages -> whole pages per request (see extract_pages_concurrent)
+    schema      -> optional schema dict behind a single schema_text; answers
+                   of pages without a page schema are validated against it
+    sink        -> optional result_sink; every page is written as one record
+                   when it finishes. Pages checkpointed by an earlier run are
+                   replayed first (the sink skips records it already holds)
+    refine      -> after extraction, ask again for the empty or invalid fields
+                   of each page with one request per page (refine_document),
+                   rendered at refine_dpi (default: the page's DPI). Pages
+                   with more than refine_max_fields such fields are left as
+                   they are. With section boxes for the page's template, only
+                   the sections holding those fields are sent
+    render_plan -> optional {schema_num: pdf_pages.RenderSettings}: DPI and
+                   encoding profile per schema instead of dpi/profile
+    progressive_dpi -> first send every page rendered at this (low) DPI, then
+                   refine the pages with empty or invalid fields at their
+                   full DPI (implies refine). Pages whose low-DPI call failed
+                   or left more than refine_max_fields such fields are
+                   extracted again whole at full DPI instead
+    """
+    max_workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+    profile = get_profile(profile)
+    page_count = pdf_page_count(pdf_path)
+    render_plan = render_plan or {}
+    refine = refine or bool(progressive_dpi)
+
+    def full_dpi(schema_num):
+        return getattr(render_plan.get(schema_num), "dpi", None) or dpi
+
+    def page_profile(schema_num):
+        return getattr(render_plan.get(schema_num), "profile", None) or profile
+
+    # The first pass renders at progressive_dpi (keeping each schema's
+    # encoding profile) or at each schema's own DPI.
+    first_dpi, first_plan = dpi, render_plan
+    if progressive_dpi:
+        first_dpi = progressive_dpi
+        first_plan = {num: RenderSettings(None, s.profile) for num, s in render_plan.items()}
+    failures = [] if failures is None else failures
+
+    finished = manifest.completed_pages(pdf_path) if manifest else {}
+    todo = [i for i in range(1, page_count + 1) if i not in finished]
+    if finished:
+        print(f"{pdf_path}: resuming, {len(finished)}/{page_count} pages already done")
+    if sink is not None:
+        for page_num in sorted(finished):
+            sink.write(page_record(pdf_path, page_num, None, finished[page_num]))
+
+    crop_plan = {}
+    if crop and page_schemas:
+        crop_plan = {
+            num: list(schema["properties"])
+            for num, schema in page_schemas.items() if schema.get("properties")
+        }
+
+    if renderer is not None:
+        rendered = iter_rendered_pages(
+            renderer, pdf_path, page_count, first_dpi, profile, ahead=max_workers, pages=todo,
+            detector=detector, crop_plan=crop_plan, classifier=classifier, render_plan=first_plan,
+        )
+    else:
+        # Without a classifier the schema is the page number, so each page
+        # can be rendered at its schema's DPI right away.
+        def source_dpi(page_num):
+            if first_plan and classifier is None:
+                return getattr(first_plan.get(page_num), "dpi", None) or first_dpi
+            return first_dpi
+
+        if first_plan and classifier is None:
+            source = ((i, render_page(pdf_path, i, source_dpi(i))) for i in todo)
+        else:
+            source = iter_pdf_pages(pdf_path, dpi=first_dpi, pages=todo)
+        rendered = (
+            (i, prepare_page(
+                i, page, profile, detector, crop_plan, classifier, dpi=source_dpi(i),
+                render_plan=first_plan,
+                rerender=lambda target, i=i: render_page(pdf_path, i, target),
+            ))
+            for i, page in timed_pages(source, pdf=str(pdf_path))
+        )
+
+    # page_num -> schema_num, filled in as pages are rendered (before the
+    # engine asks for their schema).
+    routes = {}
+    reports = {}
+
+    def logged():
+        for i, page in rendered:
+            routes[i] = page.schema_num
+            match = page.match
+            if match is not None and not match.confident:
+                print(f"Page {i}: uncertain layout match (schema {match.schema_num}, "
+                      f"score {match.score:.2f}), using schema {page.schema_num}")
+            elif page.schema_num != i:
+                print(f"Page {i}: matched schema {page.schema_num}")
+            record_prepared(i, page, pdf=str(pdf_path))
+            payload = page.payload
+            if encode_log is not None and payload is not None:
+                encode_log.extend(payload.values() if isinstance(payload, dict) else [payload])
+            if page.report is not None:
+                if blank_log is not None:
+                    blank_log.append(page.report)
+                reports[i] = page.report
+            yield i, payload, page.report
+
+    def checkpoint(page_num, result):
+        # With refine, pages go to the sink once refined.
+        if sink is not None and not refine:
+            sink.write(page_record(pdf_path, page_num, routes.get(page_num), result, failures))
+        # Failed pages are left for the next --resume.
+        if manifest and not any(f.get("page") == page_num for f in failures):
+            manifest.save_page(pdf_path, page_num, result)
+
+    # Render -> encode runs ahead of the LLM calls behind a bounded queue, so
+    # the first call starts as soon as page 1 is rendered.
+    results = extract_pages_concurrent(
+        llm, prefetch(logged(), maxsize=max_workers),
+        (lambda i: schema_text(routes[i])) if callable(schema_text) else schema_text,
+        max_workers=max_workers, on_progress=on_progress, total=len(todo),
+        cache=cache, executor=executor, on_result=checkpoint,
+        scheduler=scheduler, failures=failures,
+        page_schema=(lambda i: page_schemas.get(routes[i])) if page_schemas else None,
+        schema_format=schema_format, batch_pages=batch_pages,
+        check_schema=(lambda i: schema) if schema is not None else None,
+    )
+
+    def schema_for_page(i):
+        return (page_schemas or {}).get(routes.get(i), schema)
+
+    def is_blank(i):
+        return reports.get(i) is not None and reports[i].blank
+
+    # Top-level sections never worth asking for again: the blank ones, or
+    # all of them on a blank page.
+    skip = {
+        i: list((schema_for_page(i) or {}).get("properties") or ()) if report.blank
+        else report.blank_sections
+        for i, report in reports.items()
+    }
+
+    if progressive_dpi:
+        # Pages the low-DPI pass could not read well enough for a field-level
+        # refine (the call failed, or more than refine_max_fields fields came
+        # back empty or invalid) are extracted again, whole, at full DPI.
+        failed = {f.get("page") for f in failures}
+
+        def unreadable(i, result):
+            if i in failed:
+                return True
+            page_schema = schema_for_page(i)
+            return bool(page_schema) and isinstance(result, dict) and \
+                len(refine_paths(result, page_schema, skip.get(i, ()))) > refine_max_fields
+
+        redo = [i for i, r in zip(todo, results) if not is_blank(i) and unreadable(i, r)]
+        if redo:
+            print(f"{pdf_path}: extracting {len(redo)} page(s) again at full DPI")
+            redo_failures = []
+
+            def full_pages():
+                source = ((i, render_page(pdf_path, i, full_dpi(routes[i]))) for i in redo)
+                for i, image in timed_pages(source, pdf=str(pdf_path), progressive=1):
+                    page = prepare_page(
+                        i, image, page_profile(routes[i]), detector, crop_plan,
+                        schema_num=routes[i], dpi=full_dpi(routes[i]),
+                    )
+                    record_prepared(i, page, pdf=str(pdf_path), progressive=1)
+                    if page.report is not None:
+                        reports[i] = page.report
+                    yield i, page.payload, page.report
+
+            again = extract_pages_concurrent(
+                llm, prefetch(full_pages(), maxsize=max_workers),
+                (lambda i: schema_text(routes[i])) if callable(schema_text) else schema_text,
+                max_workers=max_workers, total=len(redo), cache=cache, executor=executor,
+                scheduler=scheduler, failures=redo_failures,
+                page_schema=(lambda i: page_schemas.get(routes[i])) if page_schemas else None,
+                schema_format=schema_format, batch_pages=batch_pages,
+                check_schema=(lambda i: schema) if schema is not None else None,
+            )
+            by_page = dict(zip(todo, results))
+            by_page.update(zip(redo, again))
+            results = [by_page[i] for i in todo]
+            failures[:] = [f for f in failures if f.get("page") not in redo] + redo_failures
+            if manifest:
+                still_failed = {f.get("page") for f in redo_failures}
+                for i in redo:
+                    if i not in still_failed:
+                        manifest.save_page(pdf_path, i, by_page[i])
+
+    if refine:
+        # Blank pages were never sent; their schema defaults stay as they are.
+        failed = {f.get("page") for f in failures}
+        fresh = {
+            i: r for i, r in zip(todo, results)
+            if i not in failed and not is_blank(i)
+        }
+
+        def region_for(page_num, paths):
+            # Union of the template boxes of the sections holding `paths`.
+            report = reports.get(page_num)
+            if detector is None or report is None or not report.has_template:
+                return None
+            boxes = detector.sections(routes.get(page_num, page_num))
+            needed = {path.split(".", 1)[0] for path in paths}
+            if not needed or not needed <= set(boxes):
+                return None
+            box = [f(boxes[name][k] for name in needed) for k, f in enumerate((min, min, max, max))]
+            return box, report.offset, report.shape
+
+        refined = refine_document(
+            llm, pdf_path, fresh, schema_for_page,
+            lambda i: refine_dpi or full_dpi(routes.get(i, i)),
+            lambda i: page_profile(routes.get(i, i)), skip, refine_max_fields,
+            max_workers, cache, executor, scheduler, schema_format, region_for,
+        )
+        for page_num, result in zip(todo, results):
+            if manifest and refined.get(page_num):
+                manifest.save_page(pdf_path, page_num, result)
+            if sink is not None:
+                sink.write(page_record(pdf_path, page_num, routes.get(page_num), result, failures))
+
+    finished.update(zip(todo, results))
+    return [finished[i] for i in range(1, page_count + 1)]
 
 def merge_page_results(results):
     merged = {}
@@ -109,44 +977,445 @@ def merge_page_results(results):
                 merged[key] = value
     return merged
 
+#Converts a schema into a Python object structure with default values.
+# Handles:
+# Objects → recursive dict
+# Arrays → empty list
+# Scalars → None or actual value
+# Useful for initializing review data and for pages skipped as blank.
+def materialize_from_schema(obj):
+
+    if isinstance(obj, dict) and "value" in obj:
+        return materialize_from_schema(obj["value"])
+
+    if isinstance(obj, dict) and "properties" in obj:
+        result = {}
+        for key, val in obj["properties"].items():
+            result[key] = materialize_from_schema(val)
+        return result
+
+    if isinstance(obj, dict) and obj.get("type") == "array":
+        return []
+
+    if isinstance(obj, dict):
+        return {
+            k: materialize_from_schema(v)
+            for k, v in obj.items()
+            if k not in {"type", "enum", "description", "items"}
+        }
+
+    if isinstance(obj, list):
+        return [materialize_from_schema(x) for x in obj]
+
+    return obj
+
+def without_sections(schema, sections):
+    """Shallow copy of `schema` without the given top-level properties."""
+    schema = dict(schema)
+    schema["properties"] = {
+        k: v for k, v in schema.get("properties", {}).items() if k not in sections
+    }
+    return schema
+
+def only_sections(schema, sections):
+    """Shallow copy of `schema` keeping only the given top-level properties."""
+    schema = dict(schema)
+    schema["properties"] = {
+        k: v for k, v in schema.get("properties", {}).items() if k in sections
+    }
+    return schema
+
+def fill_sections(result, schema, sections):
+    """Add schema defaults for `sections` (left out of the prompt as blank)."""
+    result = dict(result)
+    for name in sections:
+        result.setdefault(name, materialize_from_schema(schema["properties"][name]))
+    return result
+
+def load_page_schemas(schema_dir):
+    """schemaN.json files in `schema_dir` -> {N: schema dict}."""
+    schemas = {}
+    for path in Path(schema_dir).glob("schema*.json"):
+        num = path.stem.replace("schema", "")
+        if num.isdigit():
+            with open(path, "r", encoding="utf-8") as f:
+                schemas[int(num)] = json.load(f)
+    return dict(sorted(schemas.items()))
+
+def find_pdfs(input_dir=None, pattern=None):
+    paths = []
+    if input_dir:
+        paths += Path(input_dir).rglob("*.pdf")
+    if pattern:
+        paths += (Path(p) for p in glob.glob(pattern, recursive=True))
+    return sorted(set(paths))
+
+def write_json(path, data):
+    start = time.perf_counter()
+    atomic_write_json(path, data, indent=2)
+    pipeline_metrics.record("export", (time.perf_counter() - start) * 1000, target="json",
+                            path=str(path), bytes=os.path.getsize(path))
+
+def page_record(pdf_path, page_num, schema_num, result, failures=()):
+    """Result sink record for one page (see result_sink)."""
+    record = {"pdf": str(pdf_path), "page": page_num, "schema": schema_num, "data": result}
+    for failure in failures:
+        if failure.get("page") == page_num:
+            record["error"] = f"{failure['error']}: {failure['message']}"
+            break
+    return record
+
+def open_sink(args, page_schemas=None, schema=None):
+    """MultiSink over --jsonl and --parquet, or None without either."""
+    sinks = []
+    if args.jsonl:
+        sinks.append(JsonlSink(args.jsonl, resume=args.resume))
+    if args.parquet:
+        schemas = list((page_schemas or {}).values()) + ([schema] if schema else [])
+        fields = {path for s in schemas for path in schema_field_paths(s)}
+        sinks.append(ParquetSink(args.parquet, fields=fields or None, resume=args.resume))
+    return MultiSink(sinks) if sinks else None
+
+def run_batch(llm, pdf_paths, schema_text, args, cache=None, encode_log=None,
+              manifest=None, scheduler=None, detector=None, blank_log=None,
+              page_schemas=None, classifier=None, sink=None, schema=None, render_plan=None):
+    """
+    Extract many PDFs in one process.
+
+    Rendering/encoding runs on a process pool; LLM calls from every document
+    share one thread pool of --max-workers, so the concurrency budget holds
+    across the whole run no matter how many documents are open.
+
+    sink -> optional result_sink receiving one record per document, or per
+            page with --records page
+
+    Returns (documents that failed, documents with failed pages).
+    """
+    page_sink = sink if args.records == "page" else None
+    doc_sink = sink if args.records == "document" else None
+    if manifest:
+        remaining = [p for p in pdf_paths if not manifest.is_document_done(p)]
+        if len(remaining) < len(pdf_paths):
+            print(f"Resuming: skipping {len(pdf_paths) - len(remaining)} finished documents.")
+            # Finished documents are replayed into the sink; it keeps only
+            # the records it does not hold yet.
+            for pdf_path in sorted(set(pdf_paths) - set(remaining)):
+                if doc_sink is not None:
+                    doc_sink.write({"pdf": str(pdf_path), "data": manifest.document_result(pdf_path)})
+                if page_sink is not None:
+                    for page_num, result in sorted(manifest.completed_pages(pdf_path).items()):
+                        page_sink.write(page_record(pdf_path, page_num, None, result))
+        pdf_paths = remaining
+
+    failed = incomplete = 0
+    with ProcessPoolExecutor(max_workers=args.render_workers) as renderer, \
+            ThreadPoolExecutor(max_workers=args.max_workers) as llm_pool, \
+            ThreadPoolExecutor(max_workers=args.max_docs) as doc_pool:
+
+        def process(pdf_path):
+            failures = []
+            with pipeline_metrics.labels(pdf=str(pdf_path)):
+                pages = extract_document(
+                    llm, pdf_path, schema_text, dpi=args.dpi, profile=args.encoding,
+                    max_workers=args.max_workers, cache=cache,
+                    renderer=renderer, executor=llm_pool, encode_log=encode_log,
+                    manifest=manifest, scheduler=scheduler, failures=failures,
+                    detector=detector, blank_log=blank_log, page_schemas=page_schemas,
+                    schema_format=args.schema_format, crop=args.crop_sections,
+                    classifier=classifier, batch_pages=args.batch_pages, sink=page_sink,
+                    schema=schema, refine=args.refine, refine_dpi=args.refine_dpi,
+                    refine_max_fields=args.refine_max_fields, render_plan=render_plan,
+                    progressive_dpi=args.progressive,
+                )
+                with pipeline_metrics.timed("merge", pages=len(pages)):
+                    merged = merge_page_results(pages)
+            return pages, merged, failures
+
+        futures = {doc_pool.submit(process, p): p for p in pdf_paths}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            pdf_path = futures[fut]
+            try:
+                pages, merged, failures = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{done}/{len(pdf_paths)}] {pdf_path}: failed ({e})")
+                record = {"pdf": str(pdf_path), "error": str(e)}
+            else:
+                note = f", {len(failures)} failed" if failures else ""
+                print(f"[{done}/{len(pdf_paths)}] {pdf_path}: {len(pages)} pages{note}")
+                record = {"pdf": str(pdf_path), "pages": len(pages), "data": merged}
+                if failures:
+                    incomplete += 1
+                    record["failures"] = failures
+                    if manifest:
+                        manifest.save_failures(pdf_path, failures)
+                if args.out_dir:
+                    write_json(Path(args.out_dir) / f"{pdf_path.stem}.json", merged)
+            if doc_sink is not None:
+                doc_sink.write(record)
+            # Documents with failed pages stay open for --resume.
+            if manifest and "data" in record and not failures:
+                manifest.mark_document_done(pdf_path, merged)
+    return failed, incomplete
+
+def extract_single(llm, schema_text, args, cache=None, encode_log=None, manifest=None,
+                   scheduler=None, detector=None, blank_log=None, page_schemas=None,
+                   classifier=None, sink=None, schema=None, render_plan=None):
+    """Extract the one --pdf; writes --out and the sink records. Returns the page failures."""
+    print(f"Streaming pages from {args.pdf} ...\n")
+
+    def report(done, total, page_num):
+        print(f"Page {page_num} done ({done}/{total})")
+
+    failures = []
+    with pipeline_metrics.labels(pdf=str(args.pdf)):
+        all_page_data = extract_document(
+            llm, args.pdf, schema_text, dpi=args.dpi, profile=args.encoding,
+            max_workers=args.max_workers, cache=cache,
+            on_progress=report, encode_log=encode_log, manifest=manifest,
+            scheduler=scheduler, failures=failures,
+            detector=detector, blank_log=blank_log, page_schemas=page_schemas,
+            schema_format=args.schema_format, crop=args.crop_sections,
+            classifier=classifier, batch_pages=args.batch_pages,
+            sink=sink if args.records == "page" else None, schema=schema,
+            refine=args.refine, refine_dpi=args.refine_dpi,
+            refine_max_fields=args.refine_max_fields, render_plan=render_plan,
+            progressive_dpi=args.progressive,
+        )
+    with pipeline_metrics.timed("merge", pdf=str(args.pdf), pages=len(all_page_data)):
+        final_json = merge_page_results(all_page_data)
+    if args.out:
+        write_json(args.out, final_json)
+    if sink is not None and args.records == "document":
+        record = {"pdf": str(args.pdf), "pages": len(all_page_data), "data": final_json}
+        if failures:
+            record["failures"] = failures
+        sink.write(record)
+    if failures:
+        if manifest is not None:
+            manifest.save_failures(args.pdf, failures)
+        for record in sorted(failures, key=lambda r: r["page"]):
+            print(f"Page {record['page']} failed: {record['error']} "
+                  f"after {record['attempts']} attempt(s)")
+    elif manifest is not None:
+        manifest.mark_document_done(args.pdf, final_json)
+    return failures
+
 def main():
     parser = argparse.ArgumentParser(description="Page-wise LLM OCR with schema output")
-    parser.add_argument("--pdf", required=True, help="Path to input filled PDF")
-    parser.add_argument("--schema", required=True, help="Path to JSON schema file")
-    parser.add_argument("--out", required=True, help="Path to output JSON file")
+    parser.add_argument("--pdf", help="Path to input filled PDF")
+    parser.add_argument("--input-dir", help="Extract every PDF under this directory")
+    parser.add_argument("--glob", help="Extract every PDF matching this glob pattern")
+    parser.add_argument("--schema", help="Path to JSON schema file")
+    parser.add_argument("--page-schemas",
+                        help="Directory of schemaN.json files; each page is matched to one "
+                             "by layout (see --no-classify), --schema covers pages without one")
+    parser.add_argument("--out", help="Path to output JSON file (single --pdf)")
+    parser.add_argument("--out-dir", help="Batch mode: write one <name>.json per PDF here")
+    parser.add_argument("--jsonl", help="Append one JSON line per record to this file as results arrive")
+    parser.add_argument("--parquet",
+                        help="Write records as Parquet part files into this directory "
+                             "(flattened field paths, needs pyarrow)")
+    parser.add_argument("--records", choices=["document", "page"], default="document",
+                        help="What one --jsonl/--parquet record holds")
+    parser.add_argument("--metrics-jsonl",
+                        help="Append one JSON line per pipeline metrics event "
+                             "(render, encode, llm, request, merge, export) to this file")
+    parser.add_argument("--metrics-prom",
+                        help="Write the run's metrics in Prometheus text format to this file "
+                             "(e.g. for node_exporter's textfile collector)")
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="Maximum number of concurrent LLM requests")
+    parser.add_argument("--batch-pages", type=int, default=DEFAULT_BATCH_PAGES,
+                        help="Pages sent together in one LLM request (1 = one page per request)")
+    parser.add_argument("--max-docs", type=int, default=2,
+                        help="Batch mode: documents processed at the same time")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count(),
+                        help="Batch mode: processes used for rasterization and encoding")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI,
+                        help="Rasterization resolution")
+    parser.add_argument("--encoding", default=DEFAULT_PROFILE,
+                        help="Image encoding profile, e.g. png, jpeg-gray, 'jpeg:70,gray,max=1800'")
+    parser.add_argument("--render-config",
+                        help="Per-schema DPI and encoding, e.g. {\"3\": {\"dpi\": 200, "
+                             "\"encoding\": \"jpeg-gray\"}} (default: render.json in --page-schemas)")
+    parser.add_argument("--progressive", type=int, metavar="DPI",
+                        help="Send every page rendered at this low DPI first, then re-render "
+                             "only pages with empty or invalid fields at full DPI (implies --refine); "
+                             "pages that failed or exceed --refine-max-fields are extracted again whole")
+    parser.add_argument("--refine", action="store_true",
+                        help="Ask again, in one request per page, for the fields left "
+                             "empty or invalid by the first pass")
+    parser.add_argument("--refine-dpi", type=int,
+                        help="Rasterization resolution for --refine (default: --dpi)")
+    parser.add_argument("--refine-max-fields", type=int, default=DEFAULT_REFINE_MAX_FIELDS,
+                        help="Leave pages with more empty or invalid fields than this alone")
+    parser.add_argument("--schema-format", choices=["compact", "json"], default="compact",
+                        help="How the schema is written into the prompt")
+    parser.add_argument("--job-dir",
+                        help="Checkpoint directory (default: <output>.job)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run, skipping finished pages and documents")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM,
+                        help="LLM requests per minute allowed across all workers")
+    parser.add_argument("--tpm", type=float, default=DEFAULT_TPM,
+                        help="LLM tokens per minute allowed across all workers")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                        help="Path to the page result cache (SQLite)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always call the model, ignoring cached results")
+    parser.add_argument("--templates", default=str(TEMPLATE_DIR),
+                        help="Blank template pages used to detect unfilled pages")
+    parser.add_argument("--no-blank-skip", action="store_true",
+                        help="Send every page to the model, even pages detected as blank")
+    parser.add_argument("--crop-sections", action="store_true",
+                        help="Send each schema section as a crop of the aligned page "
+                             "(needs --page-schemas and templates/sections.json)")
+    parser.add_argument("--no-classify", action="store_true",
+                        help="With --page-schemas, use page N -> schemaN instead of "
+                             "matching each page against the templates")
     args = parser.parse_args()
 
+    batch = bool(args.input_dir or args.glob)
+    if batch == bool(args.pdf):
+        parser.error("give either --pdf or --input-dir/--glob")
+    if not batch and not (args.out or args.jsonl or args.parquet):
+        parser.error("--pdf needs --out, --jsonl and/or --parquet")
+    if batch and not (args.out_dir or args.jsonl or args.parquet):
+        parser.error("batch mode needs --out-dir, --jsonl and/or --parquet")
+    if not (args.schema or args.page_schemas):
+        parser.error("give --schema and/or --page-schemas")
+    if args.crop_sections and not args.page_schemas:
+        parser.error("--crop-sections needs --page-schemas")
+
     load_dotenv()
+    metrics = PipelineMetrics(args.metrics_jsonl).install()
     llm = LLMHandler()
+    cache = None if args.no_cache else PageCache(args.cache)
+    scheduler = RequestScheduler(requests_per_minute=args.rpm, tokens_per_minute=args.tpm)
+
+    schema = None
+    if args.schema:
+        with open(args.schema, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+    page_schemas = load_page_schemas(args.page_schemas) if args.page_schemas else {}
+
+    schema_text = build_schema_text(schema, args.schema_format) if schema is not None else None
+    classifier = None
+    if page_schemas:
+        page_texts = {n: build_schema_text(s, args.schema_format) for n, s in page_schemas.items()}
+
+        def schema_text_for(schema_num, fallback=schema_text):
+            if schema_num in page_texts:
+                return page_texts[schema_num]
+            if fallback is None:
+                raise ValueError(f"No schema{schema_num}.json in {args.page_schemas} "
+                                 "and no --schema fallback")
+            return fallback
 
-    with open(args.schema, "r", encoding="utf-8") as f:
-        schema = json.load(f)
+        schema_text = schema_text_for
+        if not args.no_classify:
+            # Route pages by layout; falls back to position without templates.
+            classifier = PageClassifier(args.templates, schema_nums=page_schemas)
 
-    schema_text = SYSTEM_INSTRUCTIONS.format(
-        schema=json.dumps(schema, indent=2, ensure_ascii=False)
+    render_config = args.render_config or (
+        str(Path(args.page_schemas) / RENDER_CONFIG) if args.page_schemas else None
     )
+    render_plan = load_render_plan(render_config) if render_config else {}
+    if args.render_config and not render_plan:
+        parser.error(f"{args.render_config}: no render settings found")
+
+    # Every finished page is checkpointed; --resume picks up from there.
+    job_dir = args.job_dir or str(
+        args.out or args.out_dir or args.jsonl or args.parquet
+    ).rstrip("/\\") + ".job"
+    manifest = JobManifest(job_dir, resume=args.resume, settings={
+        "schema": str(Path(args.schema).resolve()) if args.schema else None,
+        "page_schemas": str(Path(args.page_schemas).resolve()) if args.page_schemas else None,
+        "dpi": args.dpi,
+        "encoding": args.encoding,
+        "schema_format": args.schema_format,
+        "blank_skip": not args.no_blank_skip,
+        "crop_sections": args.crop_sections,
+        "classify": bool(page_schemas) and not args.no_classify,
+        "render_plan": {str(num): [s.dpi, s.profile] for num, s in sorted(render_plan.items())},
+        "progressive": args.progressive,
+        "refine": args.refine,
+        "refine_dpi": args.refine_dpi,
+        "refine_max_fields": args.refine_max_fields,
+        "batch_pages": args.batch_pages,
+    })
+
+    detector = None
+    if not args.no_blank_skip:
+        detector = BlankDetector(args.templates)
+    elif args.crop_sections:
+        # Alignment and section boxes only; nothing counts as blank.
+        detector = BlankDetector(args.templates, min_ink_px=0)
+    encode_log = []
+    blank_log = []
+    failed = incomplete = 0
+    page_failures = []
+    try:
+        sink = open_sink(args, page_schemas, schema)
+    except ImportError as e:
+        parser.error(str(e))
+
+    try:
+        if batch:
+            pdf_paths = find_pdfs(args.input_dir, args.glob)
+            print(f"Found {len(pdf_paths)} PDFs.\n")
+            failed, incomplete = run_batch(llm, pdf_paths, schema_text, args, cache, encode_log,
+                               manifest, scheduler, detector, blank_log, page_schemas,
+                               classifier, sink, schema, render_plan)
+        else:
+            page_failures = extract_single(llm, schema_text, args, cache, encode_log, manifest, scheduler,
+                           detector, blank_log, page_schemas, classifier, sink, schema,
+                           render_plan)
+    finally:
+        if sink is not None:
+            sink.close()
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
+        metrics.close()
+
+    if encode_log:
+        total_bytes = sum(e.size for e in encode_log)
+        print(f"Encoding ({args.encoding}): {total_bytes / 1024 / len(encode_log):.0f} KiB/page, "
+              f"{sum(e.encode_ms for e in encode_log) / len(encode_log):.0f} ms/page")
 
-    print(f"Converting {args.pdf} to images...")
-    pages = convert_from_path(args.pdf, dpi=150)
-    print(f"{len(pages)} pages converted.\n")
+    if blank_log:
+        skips = skip_summary(blank_log)
+        print(f"Blank pages: {skips['blank_pages']}/{skips['pages']} skipped "
+              f"({skips['skip_rate']:.0%}), {skips['blank_sections']} blank sections left out")
 
-    all_page_data = []
-    for i, page in enumerate(pages, start=1):
-        with tempfile.NamedTemporaryFile(suffix=".png") as tmp:
-            page.save(tmp.name, "PNG")
-            with open(tmp.name, "rb") as img_file:
-                img_bytes = img_file.read()
-            page_json = extract_page_json(llm, img_bytes, i, schema_text)
-            all_page_data.append(page_json)
+    usage = llm.usage_summary()
+    if usage["calls"]:
+        print(f"Tokens ({args.schema_format} schema): {usage['prompt_tokens']} prompt / "
+              f"{usage['response_tokens']} response over {usage['calls']} calls, "
+              f"{usage['prompt_tokens_per_call']:.0f} prompt tokens per request")
 
-    final_json = merge_page_results(all_page_data)
+    pipeline_metrics.print_summary(metrics)
 
-    out_path = Path(args.out)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(final_json, f, indent=2, ensure_ascii=False)
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"{stats['entries']} entries ({stats['bytes'] / 1024:.0f} KiB)")
 
-    print(f"\nFexExtraction complete! Combined JSON saved to {out_path}")
+    # A non-zero exit tells batch and cron callers that pages are missing;
+    # rerun with --resume to retry them.
+    if batch:
+        note = f", {incomplete} with failed pages" if incomplete else ""
+        print(f"\nBatch complete: {len(pdf_paths) - failed} succeeded, {failed} failed{note}.")
+        if failed or incomplete:
+            sys.exit(1)
+    else:
+        saved = ", ".join(p for p in (args.out, args.jsonl, args.parquet) if p)
+        if page_failures:
+            print(f"\nExtraction incomplete: {len(page_failures)} page(s) failed. "
+                  f"Results saved to {saved}")
+            sys.exit(1)
+        print(f"\nFexExtraction complete! Results saved to {saved}")
 
 if __name__ == "__main__":
     main()
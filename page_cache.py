@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Content-addressed cache of page extraction results.
+#
+# Keys are a SHA-256 over everything that can change the model output for a
+# page (image bytes, schema text, prompt, model name, generation config), so
+# a re-run of an unchanged page is served from disk without calling the LLM.
+
+DEFAULT_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", ".cache/page_cache.sqlite")
+DEFAULT_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_MB", "256")) * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = float(os.getenv("PAGE_CACHE_MAX_AGE_DAYS", "30"))
+
+# Run size/age eviction after this many writes.
+EVICT_EVERY = 50
+
+
+def make_cache_key(image_bytes, schema_text, prompt, model_name, generation_config):
+    h = hashlib.sha256()
+    for part in (
+        image_bytes,
+        schema_text.encode("utf-8"),
+        prompt.encode("utf-8"),
+        str(model_name).encode("utf-8"),
+        json.dumps(generation_config or {}, sort_keys=True).encode("utf-8"),
+    ):
+        # Length-prefix each part so boundaries cannot collide.
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+class PageCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS):
+        """
+        SQLite-backed store shared by all worker threads of a process.
+
+        max_bytes     -> least recently used entries are dropped above this size
+        max_age_days  -> entries older than this are dropped regardless of use
+        """
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages(accessed)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE pages SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+            self.writes += 1
+            due = self.writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM pages WHERE created < ?", (time.time() - self.max_age,)
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+            if total > self.max_bytes:
+                freed = 0
+                stale = []
+                for key, size in self._conn.execute(
+                    "SELECT key, size FROM pages ORDER BY accessed ASC"
+                ):
+                    if total - freed <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    freed += size
+                self._conn.executemany("DELETE FROM pages WHERE key = ?", stale)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,133 @@
+import os
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from page_templates import TEMPLATE_DIR, load_template
+
+# Local page -> schema classifier.
+#
+# Every registered template page (templates/pageN.png, matching
+# schemas/schemaN.json) is reduced once to a small normalized layout vector.
+# A rendered page is reduced the same way and matched by correlation, so a
+# packet with missing, reordered or duplicated pages still gets the right
+# schema for each page, in about a millisecond per page.
+
+# Layout vectors are computed at this size (width, height).
+FEATURE_SIZE = (48, 64)
+
+# A match is trusted when its correlation and its lead over the runner-up
+# reach these values; otherwise callers fall back to the page position or ask.
+MIN_SCORE = float(os.getenv("PAGE_CLASSIFIER_MIN_SCORE", "0.5"))
+MIN_MARGIN = float(os.getenv("PAGE_CLASSIFIER_MIN_MARGIN", "0.05"))
+
+
+@dataclass
+class PageMatch:
+    schema_num: int
+    score: float       # correlation with the best template, -1..1
+    margin: float      # lead over the second-best template
+    confident: bool
+
+
+def layout_vector(image):
+    """PIL image or grayscale array -> zero-mean, unit-length ink layout vector."""
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(np.asarray(image))
+    small = image.convert("L").resize(FEATURE_SIZE, Image.BOX)
+    ink = 255.0 - np.asarray(small, dtype=np.float32).ravel()
+    ink -= ink.mean()
+    norm = np.linalg.norm(ink)
+    return ink / norm if norm else ink
+
+
+class PageClassifier:
+    def __init__(self, template_dir=TEMPLATE_DIR, schema_nums=None,
+                 min_score=MIN_SCORE, min_margin=MIN_MARGIN):
+        """
+        schema_nums -> schema numbers that exist; templates without a schema
+                       are not indexed and positional fallbacks are limited
+                       to these (None: no restriction)
+        """
+        self.template_dir = str(template_dir)
+        self.schema_nums = None if schema_nums is None else set(schema_nums)
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self._index = None
+
+    def __getstate__(self):
+        # Sent to render worker processes: rebuild the index there.
+        state = self.__dict__.copy()
+        state["_index"] = None
+        return state
+
+    def index(self):
+        """(schema numbers, matrix of layout vectors), built once."""
+        if self._index is None:
+            nums = sorted(
+                int(path.stem[len("page"):])
+                for path in Path(self.template_dir).glob("page*.png")
+                if path.stem[len("page"):].isdigit()
+            )
+            if self.schema_nums is not None:
+                nums = [num for num in nums if num in self.schema_nums]
+            vectors = [layout_vector(load_template(num, self.template_dir)) for num in nums]
+            matrix = np.stack(vectors) if vectors else np.zeros((0, FEATURE_SIZE[0] * FEATURE_SIZE[1]))
+            self._index = (nums, matrix)
+        return self._index
+
+    def __len__(self):
+        return len(self.index()[0])
+
+    def classify(self, image):
+        """Best-matching schema number for a page, or None without templates."""
+        nums, matrix = self.index()
+        if not nums:
+            return None
+        scores = matrix @ layout_vector(image)
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        margin = best - float(scores[order[1]]) if len(order) > 1 else best
+        return PageMatch(
+            nums[order[0]], best, margin,
+            best >= self.min_score and margin >= self.min_margin,
+        )
+
+    def route(self, page_num, image):
+        """
+        Schema number to use for a page: the classified one when confident,
+        else its position if that schema exists, else the best guess.
+        Returns (schema_num or None, PageMatch or None).
+        """
+        match = self.classify(image)
+        if match is not None and match.confident:
+            return match.schema_num, match
+        if self.schema_nums is None or page_num in self.schema_nums:
+            return page_num, match
+        return (match.schema_num if match is not None else None), match
+
+
+def main():
+    from pdf_pages import iter_pdf_pages
+
+    parser = argparse.ArgumentParser(description="Classify the pages of a PDF against the templates")
+    parser.add_argument("--pdf", required=True, help="Filled PDF to classify")
+    parser.add_argument("--templates", default=str(TEMPLATE_DIR), help="Template directory")
+    args = parser.parse_args()
+
+    classifier = PageClassifier(args.templates)
+    print(f"{len(classifier)} templates indexed")
+    for page_num, image in iter_pdf_pages(args.pdf, dpi=72):
+        match = classifier.classify(image)
+        if match is None:
+            print(f"Page {page_num}: no templates")
+            continue
+        flag = "" if match.confident else "  (low confidence)"
+        print(f"Page {page_num}: schema {match.schema_num}  score {match.score:.2f}  "
+              f"margin {match.margin:.2f}{flag}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Registry of blank template pages.
+#
+# templates/page<N>.png   the printed, unfilled page N (grayscale, ANALYSIS_WIDTH wide)
+# templates/sections.json optional section boxes per page, as page fractions:
+#     {"1": {"generalInfo": [x0, y0, x1, y1], "programsServices": [...]}}
+#
+# Filled pages are aligned to their template (translation only, by FFT phase
+# correlation) before comparing ink or cropping sections.
+#
+# Page N corresponds to schemas/schemaN.json. Register templates from a blank
+# copy of the packet with:
+#     python page_templates.py --blank-pdf blank_packet.pdf
+
+BASE_DIR = Path(__file__).resolve().parent
+TEMPLATE_DIR = Path(os.getenv("PAGE_TEMPLATE_DIR", BASE_DIR / "templates"))
+
+# Pages are compared at this width; enough for pen strokes, cheap for NumPy.
+ANALYSIS_WIDTH = 850
+
+# Largest scan offset (analysis pixels) alignment will correct; anything
+# bigger is treated as a failed match and ignored.
+MAX_SHIFT = 60
+
+# Margin added around section crops, as a fraction of the page, so
+# handwriting that strays over a box edge is kept.
+CROP_PAD = 0.01
+
+
+def to_analysis_gray(image, shape=None):
+    """PIL image -> uint8 grayscale array at analysis resolution (or `shape`)."""
+    gray = image.convert("L")
+    if shape is not None:
+        size = (shape[1], shape[0])
+    else:
+        size = (ANALYSIS_WIDTH, round(gray.height * ANALYSIS_WIDTH / gray.width))
+    if gray.size != size:
+        gray = gray.resize(size, Image.BILINEAR)
+    return np.asarray(gray)
+
+def template_path(page_num, template_dir=TEMPLATE_DIR):
+    return Path(template_dir) / f"page{page_num}.png"
+
+def load_template(page_num, template_dir=TEMPLATE_DIR):
+    path = template_path(page_num, template_dir)
+    if not path.exists():
+        return None
+    with Image.open(path) as image:
+        return to_analysis_gray(image)
+
+def load_sections(template_dir=TEMPLATE_DIR):
+    path = Path(template_dir) / "sections.json"
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {int(page): boxes for page, boxes in json.load(f).items()}
+
+def box_slice(box, shape, offset=(0, 0)):
+    """Fractional [x0, y0, x1, y1] -> numpy slices for an array of `shape`."""
+    height, width = shape[:2]
+    dy, dx = offset
+    x0, y0, x1, y1 = box
+    return (slice(max(0, int(y0 * height) + dy), max(0, int(y1 * height) + dy)),
+            slice(max(0, int(x0 * width) + dx), max(0, int(x1 * width) + dx)))
+
+def estimate_offset(page, template, max_shift=MAX_SHIFT):
+    """
+    (dy, dx) by which `page` content is shifted relative to `template`, both
+    grayscale arrays of the same shape. Phase correlation: the peak of the
+    normalized cross-power spectrum sits at the translation.
+    """
+    a = 255.0 - page.astype(np.float32)
+    b = 255.0 - template.astype(np.float32)
+    spectrum = np.fft.rfft2(a - a.mean()) * np.conj(np.fft.rfft2(b - b.mean()))
+    spectrum /= np.abs(spectrum) + 1e-9
+    corr = np.fft.irfft2(spectrum, s=a.shape)
+
+    dy, dx = np.unravel_index(int(np.argmax(corr)), corr.shape)
+    height, width = corr.shape
+    dy = dy - height if dy > height // 2 else dy
+    dx = dx - width if dx > width // 2 else dx
+    if abs(dy) > max_shift or abs(dx) > max_shift:
+        return 0, 0
+    return int(dy), int(dx)
+
+def shift_array(array, offset, fill=0):
+    """Move array content by (dy, dx), filling uncovered cells with `fill`."""
+    dy, dx = offset
+    if not dy and not dx:
+        return array
+    out = np.full_like(array, fill)
+    height, width = array.shape[:2]
+    out[max(0, dy):height + min(0, dy), max(0, dx):width + min(0, dx)] = \
+        array[max(0, -dy):height + min(0, -dy), max(0, -dx):width + min(0, -dx)]
+    return out
+
+def crop_sections(image, boxes, offset=(0, 0), analysis_shape=None, pad=CROP_PAD):
+    """
+    Crop template section boxes out of a full-resolution page.
+
+    boxes           -> {section: [x0, y0, x1, y1]} as template page fractions
+    offset          -> (dy, dx) alignment in analysis pixels
+    analysis_shape  -> shape the offset was measured at
+
+    Returns {section: PIL image}.
+    """
+    width, height = image.size
+    if analysis_shape is not None:
+        dy, dx = offset[0] / analysis_shape[0], offset[1] / analysis_shape[1]
+    else:
+        dy = dx = 0.0
+    crops = {}
+    for name, (x0, y0, x1, y1) in boxes.items():
+        left = max(0.0, x0 + dx - pad)
+        top = max(0.0, y0 + dy - pad)
+        right = min(1.0, x1 + dx + pad)
+        bottom = min(1.0, y1 + dy + pad)
+        crops[name] = image.crop((round(left * width), round(top * height),
+                                  round(right * width), round(bottom * height)))
+    return crops
+
+def register_templates(blank_pdf, template_dir=TEMPLATE_DIR, first_page_num=1, dpi=100):
+    """Render a blank packet and store each page as a template. Returns the paths."""
+    from pdf2image import convert_from_path
+
+    template_dir = Path(template_dir)
+    template_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for offset, image in enumerate(convert_from_path(str(blank_pdf), dpi=dpi)):
+        path = template_path(first_page_num + offset, template_dir)
+        Image.fromarray(to_analysis_gray(image)).save(path, "PNG", optimize=True)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register blank template pages")
+    parser.add_argument("--blank-pdf", required=True, help="Unfilled copy of the form packet")
+    parser.add_argument("--out-dir", default=str(TEMPLATE_DIR), help="Template directory")
+    parser.add_argument("--first-page", type=int, default=1,
+                        help="Schema number of the PDF's first page")
+    args = parser.parse_args()
+
+    for path in register_templates(args.blank_pdf, args.out_dir, args.first_page):
+        print(f"Saved {path}")
+
+if __name__ == "__main__":
+    main()
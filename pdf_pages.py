@@ -0,0 +1,200 @@
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from PIL import Image
+
+from image_encoding import encode_page
+from page_templates import crop_sections
+
+# PDF rasterization helpers.
+#
+# Kept free of LLM/Streamlit imports so process-pool workers that render and
+# encode pages stay light.
+
+DEFAULT_DPI = 150
+
+# Per-schema rendering, next to the page schemas:
+#   {"3": {"dpi": 200, "encoding": "jpeg-gray"}, "7": {"dpi": 100}}
+# Dense handwritten pages can get more resolution and checkbox pages less.
+# Schemas not listed use --dpi / --encoding.
+RENDER_CONFIG = "render.json"
+
+
+@dataclass(frozen=True)
+class RenderSettings:
+    dpi: Optional[int] = None        # None: the run's DPI
+    profile: Optional[str] = None    # encoding profile spec; None: the run's profile
+
+
+def load_render_plan(path):
+    """render.json -> {schema_num: RenderSettings}; {} when the file does not exist."""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return {
+            int(num): RenderSettings(entry.get("dpi"), entry.get("encoding"))
+            for num, entry in json.load(f).items()
+        }
+
+def fit_dpi(image, dpi, target_dpi, rerender=None):
+    """
+    `image` (rendered at `dpi`) at target_dpi: scaled down in memory when the
+    target is lower, rendered again with rerender(target_dpi) when it is
+    higher. Without rerender a lower-resolution image is kept as it is.
+    """
+    if not target_dpi or target_dpi == dpi:
+        return image
+    if target_dpi < dpi:
+        scale = target_dpi / dpi
+        return image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                            Image.LANCZOS)
+    return rerender(target_dpi) if rerender is not None else image
+
+
+@dataclass
+class PreparedPage:
+    payload: Any                   # EncodedPage, {section: EncodedPage} crops, or None if blank
+    report: Any = None             # BlankReport from the blank detector
+    schema_num: Optional[int] = None  # schema/template the page was routed to
+    match: Any = None              # PageMatch from the page classifier
+    render_ms: Optional[float] = None  # rasterization time, for pipeline_metrics
+    dpi: Optional[int] = None      # resolution the payload was made from
+
+
+def pdf_page_count(pdf_path):
+    return int(pdfinfo_from_path(str(pdf_path))["Pages"])
+
+def _windows(page_nums, window):
+    # Group sorted page numbers into contiguous runs of at most `window` pages.
+    run = []
+    for page_num in page_nums:
+        if run and (page_num != run[-1] + 1 or len(run) >= window):
+            yield run[0], run[-1]
+            run = []
+        run.append(page_num)
+    if run:
+        yield run[0], run[-1]
+
+def iter_pdf_pages(pdf_path, dpi=DEFAULT_DPI, window=1, page_count=None, pages=None):
+    """
+    Rasterize a PDF lazily, `window` pages per poppler call.
+
+    Yields (page_num, PIL image) as soon as each window is rendered, so only
+    a handful of full-resolution pages are alive at any time instead of the
+    whole document. `pages` restricts rendering to those page numbers.
+    """
+    if pages is None:
+        page_count = page_count or pdf_page_count(pdf_path)
+        pages = range(1, page_count + 1)
+    for first, last in _windows(sorted(pages), max(1, window)):
+        images = convert_from_path(str(pdf_path), dpi=dpi, first_page=first, last_page=last)
+        for offset, image in enumerate(images):
+            yield first + offset, image
+        del images
+
+def prepare_page(page_num, image, profile=None, detector=None, crop_plan=None,
+                 classifier=None, schema_num=None, dpi=DEFAULT_DPI, render_plan=None,
+                 rerender=None):
+    """
+    Routing, blank check, section cropping and encoding for one rendered page.
+
+    detector    -> optional blank_detection.BlankDetector
+    crop_plan   -> optional {schema_num: section names}; when the template's
+                   section boxes cover all of a page's sections (blank ones
+                   aside), each section is cropped from the aligned page
+    classifier  -> optional page_classifier.PageClassifier choosing the
+                   schema (and template) for the page
+    schema_num  -> schema already chosen for the page (skips classification);
+                   by default the page number
+    dpi         -> resolution `image` was rendered at
+    render_plan -> optional {schema_num: RenderSettings}; once the page is
+                   routed, its schema's DPI (see fit_dpi, with rerender) and
+                   encoding profile replace the run's
+
+    Returns a PreparedPage. Its payload is None for blank pages,
+    {section: EncodedPage} for cropped pages and an EncodedPage otherwise.
+    """
+    match = None
+    if schema_num is None:
+        schema_num = page_num
+        if classifier is not None:
+            schema_num, match = classifier.route(page_num, image)
+    template_num = schema_num if schema_num is not None else page_num
+
+    render_ms = None
+    settings = (render_plan or {}).get(schema_num)
+    if settings is not None:
+        if settings.dpi and settings.dpi != dpi:
+            start = time.perf_counter()
+            image = fit_dpi(image, dpi, settings.dpi, rerender)
+            if settings.dpi < dpi or rerender is not None:
+                dpi = settings.dpi
+                render_ms = (time.perf_counter() - start) * 1000
+        profile = settings.profile or profile
+
+    def prepared(payload, report=None):
+        return PreparedPage(payload, report, schema_num, match, render_ms, dpi)
+
+    report = detector.check(template_num, image) if detector is not None else None
+    if report is None:
+        return prepared(encode_page(image, profile))
+    report.page_num = page_num
+    if report.blank:
+        return prepared(None, report)
+
+    sections = (crop_plan or {}).get(schema_num) or ()
+    boxes = detector.sections(template_num) if sections and report.has_template else {}
+    needed = [name for name in sections if name not in report.blank_sections]
+    if needed and all(name in boxes for name in needed):
+        crops = crop_sections(image, {name: boxes[name] for name in needed},
+                              report.offset, report.shape)
+        payload = {name: encode_page(part, profile) for name, part in crops.items()}
+        return prepared(payload, report)
+    return prepared(encode_page(image, profile), report)
+
+def render_page(pdf_path, page_num, dpi=DEFAULT_DPI):
+    return convert_from_path(str(pdf_path), dpi=dpi, first_page=page_num, last_page=page_num)[0]
+
+def render_encoded_page(pdf_path, page_num, dpi=DEFAULT_DPI, profile=None, detector=None,
+                        crop_plan=None, classifier=None, render_plan=None):
+    """Render and prepare a single page (see prepare_page). Runs inside process-pool workers."""
+    if render_plan and classifier is None:
+        # The schema is the page number: render at its DPI right away.
+        dpi = getattr(render_plan.get(page_num), "dpi", None) or dpi
+    start = time.perf_counter()
+    image = render_page(pdf_path, page_num, dpi)
+    render_ms = (time.perf_counter() - start) * 1000
+    prepared = prepare_page(
+        page_num, image, profile, detector, crop_plan, classifier, dpi=dpi,
+        render_plan=render_plan, rerender=lambda target: render_page(pdf_path, page_num, target),
+    )
+    prepared.render_ms = render_ms + (prepared.render_ms or 0)
+    return prepared
+
+def iter_rendered_pages(renderer, pdf_path, page_count, dpi=DEFAULT_DPI,
+                        profile=None, ahead=4, pages=None, detector=None, crop_plan=None,
+                        classifier=None, render_plan=None):
+    """
+    Render and encode pages on a process pool, yielding (page_num,
+    PreparedPage) in page order (see prepare_page). At most `ahead` pages are
+    queued on the pool at once so a long document cannot flood memory with
+    encoded pages.
+    """
+    todo = deque(sorted(pages) if pages is not None else range(1, page_count + 1))
+    pending = deque()
+    while todo or pending:
+        while todo and len(pending) < max(1, ahead):
+            page_num = todo.popleft()
+            pending.append((page_num, renderer.submit(
+                render_encoded_page, str(pdf_path), page_num, dpi, profile, detector,
+                crop_plan, classifier, render_plan,
+            )))
+        page_num, fut = pending.popleft()
+        yield page_num, fut.result()
@@ -0,0 +1,348 @@
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+# Per-stage metrics for the extraction pipeline.
+#
+# Every stage reports small events into the active PipelineMetrics:
+#
+#   render   PDF page -> image (ms)
+#   encode   image -> upload payload (ms, bytes)
+#   llm      one model call (ms, prompt/response tokens, repaired: 1 when the
+#            JSON answer needed json_repair, failed: 1 when the call raised)
+#   request  one scheduled request including its retries (ms with throttling
+#            and backoff, attempts, retries, failed)
+#   merge    page results -> one document (ms)
+#   export   output writes: JSON files, JSONL lines, Parquet parts, Excel (ms, bytes)
+#
+# Events carry the page and, where known, the PDF, so time, tokens and bytes
+# can be broken down per page and per document. The CLI installs one
+# collector for the whole process (--metrics-jsonl / --metrics-prom). The app
+# activates one per extraction job: the collector and labels (e.g. the PDF)
+# live in context variables, which pool and prefetch threads inherit through
+# carry_context. With no collector active, record() does nothing, so the
+# stage code calls it unconditionally.
+#
+# Memory stays flat however long the run: raw events go to the JSONL file as
+# they arrive, and the collector keeps running totals per stage and for the
+# most recent documents, with a bounded uniform sample of each stage's times
+# for the quantiles (counts, totals and maxima are exact).
+
+METRIC_PREFIX = os.getenv("METRICS_PREFIX", "form_extraction")
+
+# Quantiles reported per stage.
+QUANTILES = (0.5, 0.95)
+
+# Numeric event fields summed per stage and per document.
+SUMMED_FIELDS = ("bytes", "prompt_tokens", "response_tokens", "retries", "repaired", "failed")
+
+# Event times sampled per stage for the quantiles (reservoir sampling).
+RESERVOIR_SIZE = int(os.getenv("METRICS_RESERVOIR_SIZE", "2048"))
+
+# Documents whose totals documents() keeps (the most recently active ones).
+MAX_DOCUMENTS = int(os.getenv("METRICS_MAX_DOCUMENTS", "256"))
+
+_active = contextvars.ContextVar("pipeline_metrics", default=None)
+_labels = contextvars.ContextVar("pipeline_metrics_labels", default={})
+_process_default = None
+
+
+def _quantile(values, q):
+    # Nearest-rank quantile of sorted values.
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))]
+
+def _label_text(labels):
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _StageStats:
+    """Running totals of one stage and a uniform sample of its event times."""
+
+    def __init__(self, size, rng):
+        self.count = 0
+        self.timed = 0
+        self.ms = 0.0
+        self.max_ms = 0.0
+        self.sums = {}
+        self.samples = []
+        self._size = size
+        self._rng = rng
+
+    def add(self, event):
+        self.count += 1
+        for name in SUMMED_FIELDS:
+            if event.get(name):
+                self.sums[name] = self.sums.get(name, 0) + event[name]
+        ms = event.get("ms")
+        if ms is None:
+            return
+        self.timed += 1
+        self.ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        if len(self.samples) < self._size:
+            self.samples.append(ms)
+        else:
+            slot = self._rng.randrange(self.timed)
+            if slot < self._size:
+                self.samples[slot] = ms
+
+
+class PipelineMetrics:
+    def __init__(self, jsonl_path=None, run_id=None, keep_events=False,
+                 reservoir_size=RESERVOIR_SIZE):
+        """
+        jsonl_path  -> optional file receiving one JSON line per event as it
+                       is recorded (appended; the run id tells runs apart)
+        run_id      -> identifier written with every event (default: random)
+        keep_events -> also keep the raw events in .events (for short runs,
+                       e.g. one document in the app; otherwise only totals
+                       are kept)
+        reservoir_size -> event times sampled per stage for the quantiles
+        """
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.events = []
+        self._keep_events = keep_events
+        self._reservoir_size = max(1, reservoir_size)
+        self._rng = random.Random()
+        self._stages = {}
+        self._documents = OrderedDict()
+        self._documents_dropped = 0
+        self._lock = threading.Lock()
+        self._file = None
+        if jsonl_path:
+            Path(jsonl_path).parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(jsonl_path, "a", encoding="utf-8")
+
+    def record(self, stage, ms=None, **fields):
+        event = {"ts": round(time.time(), 3), "run": self.run_id, "stage": stage}
+        if ms is not None:
+            event["ms"] = round(ms, 2)
+        event.update((k, v) for k, v in fields.items() if v is not None)
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = _StageStats(self._reservoir_size, self._rng)
+            stats.add(event)
+            if event.get("pdf"):
+                self._add_document(event)
+            if self._keep_events:
+                self.events.append(event)
+            if self._file is not None:
+                self._file.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+                self._file.flush()
+
+    @contextmanager
+    def activate(self):
+        """Make this the collector for the current context (and threads started from it)."""
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    def install(self):
+        """Make this the collector for every thread without an activated one (CLI runs)."""
+        global _process_default
+        _process_default = self
+        return self
+
+    def _add_document(self, event):
+        doc = self._documents.get(event["pdf"])
+        if doc is None:
+            doc = self._documents[event["pdf"]] = {"pages": set()}
+            if len(self._documents) > MAX_DOCUMENTS:
+                self._documents.popitem(last=False)
+                self._documents_dropped += 1
+        else:
+            self._documents.move_to_end(event["pdf"])
+        if "page" in event:
+            doc["pages"].add(event["page"])
+        key = f"{event['stage']}_ms"
+        doc[key] = doc.get(key, 0.0) + event.get("ms", 0.0)
+        for name in SUMMED_FIELDS:
+            if event.get(name):
+                doc[name] = doc.get(name, 0) + event[name]
+
+    def summary(self):
+        """
+        Per-stage totals: {stage: {"count", "ms", "p50_ms", "p95_ms",
+        "max_ms", <SUMMED_FIELDS>}}, stages in the order first seen. The
+        quantiles come from the sampled times.
+        """
+        out = {}
+        with self._lock:
+            for stage, stats in self._stages.items():
+                samples = sorted(stats.samples)
+                out[stage] = {
+                    "count": stats.count,
+                    "ms": stats.ms,
+                    "p50_ms": _quantile(samples, 0.5),
+                    "p95_ms": _quantile(samples, 0.95),
+                    "max_ms": stats.max_ms,
+                    **stats.sums,
+                }
+        return out
+
+    def quantiles(self, stage, qs=QUANTILES):
+        """[ms at each quantile in qs] of a stage's sampled event times."""
+        with self._lock:
+            stats = self._stages.get(stage)
+            samples = sorted(stats.samples) if stats else []
+        return [_quantile(samples, q) for q in qs]
+
+    def documents(self):
+        """
+        {pdf: {"<stage>_ms": total ms, <SUMMED_FIELDS>, "pages"}} for events
+        that carry a pdf, for the last MAX_DOCUMENTS documents.
+        """
+        with self._lock:
+            return {
+                pdf: {**doc, "pages": len(doc["pages"])}
+                for pdf, doc in self._documents.items()
+            }
+
+    def prometheus_text(self, prefix=METRIC_PREFIX):
+        """The run's totals in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for suffix, labels, value in samples:
+                value = round(value, 6) if isinstance(value, float) else value
+                lines.append(f"{prefix}_{name}{suffix}{_label_text(labels)} {value}")
+
+        stage_samples = []
+        for stage, row in summary.items():
+            for q, ms in zip(QUANTILES, self.quantiles(stage)):
+                stage_samples.append(("", {"stage": stage, "quantile": q}, ms / 1000))
+            stage_samples.append(("_sum", {"stage": stage}, row["ms"] / 1000))
+            stage_samples.append(("_count", {"stage": stage}, row["count"]))
+        metric("stage_seconds", "summary", "Time spent per pipeline stage event.", stage_samples)
+
+        def total(stage, name):
+            return summary.get(stage, {}).get(name, 0)
+
+        metric("encoded_bytes_total", "counter", "Bytes of encoded page payloads.",
+               [("", {}, total("encode", "bytes"))])
+        metric("export_bytes_total", "counter", "Bytes written by exports.",
+               [("", {}, total("export", "bytes"))])
+        metric("llm_tokens_total", "counter", "Model tokens by direction.", [
+            ("", {"direction": "prompt"}, total("llm", "prompt_tokens")),
+            ("", {"direction": "response"}, total("llm", "response_tokens")),
+        ])
+        metric("llm_retries_total", "counter", "Request attempts beyond the first.",
+               [("", {}, total("request", "retries"))])
+        metric("llm_failed_total", "counter", "Model calls and requests that raised.", [
+            ("", {"stage": "llm"}, total("llm", "failed")),
+            ("", {"stage": "request"}, total("request", "failed")),
+        ])
+        metric("json_repairs_total", "counter", "Model answers that needed json_repair.",
+               [("", {}, total("llm", "repaired"))])
+        with self._lock:
+            documents = len(self._documents) + self._documents_dropped
+        metric("documents_total", "gauge", "Documents seen in the run.", [("", {}, documents)])
+        metric("last_run_timestamp_seconds", "gauge", "When the run started.",
+               [("", {}, self.started)])
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix=METRIC_PREFIX):
+        """
+        Write prometheus_text() for node_exporter's textfile collector. The
+        file is replaced atomically so the collector never reads half of it.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(self.prometheus_text(prefix), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def close(self):
+        global _process_default
+        if _process_default is self:
+            _process_default = None
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def current():
+    return _active.get() or _process_default
+
+def record(stage, ms=None, **fields):
+    """Record an event into the active collector, adding the context labels."""
+    metrics = current()
+    if metrics is not None:
+        metrics.record(stage, ms, **{**_labels.get(), **fields})
+
+@contextmanager
+def timed(stage, **fields):
+    """Time the block as one `stage` event (recorded even if the block raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000, **fields)
+
+@contextmanager
+def labels(**fields):
+    """Add fields (e.g. pdf=...) to every event recorded in this context."""
+    token = _labels.set({**_labels.get(), **fields})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+def carry_context(fn, **fields):
+    """
+    fn bound to a copy of the current context, for handing to another
+    thread; `fields` are added as labels (see labels) while it runs.
+    """
+    ctx = contextvars.copy_context()
+
+    def labelled(*args, **kwargs):
+        with labels(**fields):
+            return fn(*args, **kwargs)
+
+    def run(*args, **kwargs):
+        return ctx.run(labelled if fields else fn, *args, **kwargs)
+    return run
+
+def record_prepared(page_num, prepared, **fields):
+    """render/encode events for a pdf_pages.PreparedPage (crops are one encode event each)."""
+    if getattr(prepared, "render_ms", None) is not None:
+        record("render", prepared.render_ms, page=page_num, **fields)
+    payload = prepared.payload
+    if payload is None:
+        return
+    encoded = payload.items() if isinstance(payload, dict) else [(None, payload)]
+    for section, page in encoded:
+        record("encode", page.encode_ms, page=page_num, section=section, bytes=page.size,
+               mime=page.mime_type, **fields)
+
+def print_summary(metrics):
+    """Per-stage table for the end of a CLI run."""
+    summary = metrics.summary()
+    if not summary:
+        return
+    print("Stage      events    total s    p50 ms    p95 ms  extra")
+    for stage, row in summary.items():
+        extra = ", ".join(f"{name}={row[name]:g}" for name in SUMMED_FIELDS if name in row)
+        print(f"{stage:<10}{row['count']:>7}{row['ms'] / 1000:>11.2f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}  {extra}")
@@ -0,0 +1,266 @@
+import os
+import re
+import time
+import random
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import pipeline_metrics
+
+# Central scheduler for LLM requests.
+#
+# All workers in a process go through one RequestScheduler, which
+#   - paces requests with requests-per-minute and tokens-per-minute buckets,
+#   - classifies failures (rate limit, timeout, server, parse, client),
+#   - retries retryable failures with jittered exponential backoff, honoring
+#     any retry-after hint from the provider,
+#   - trips a shared circuit breaker when the provider looks degraded, which
+#     pauses every worker instead of letting them hammer the API together.
+
+DEFAULT_RPM = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+DEFAULT_TPM = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+
+# Rough cost of one page image for token budgeting (Gemini bills ~258 tokens
+# per image tile); the response is budgeted at a fixed allowance.
+IMAGE_TOKENS = 258
+RESPONSE_TOKENS = 1024
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Block until `amount` tokens are available, then take them."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        """
+        Opens after `failure_threshold` consecutive provider failures (or on
+        an explicit rate-limit pause) and blocks every caller until the
+        cooldown has passed. A success closes it again.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def pause(self, seconds):
+        with self._lock:
+            self.open_until = max(self.open_until, time.monotonic() + seconds)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                print(f"Circuit breaker open: pausing all LLM requests for {self.cooldown:.0f}s")
+                self.open_until = max(self.open_until, time.monotonic() + self.cooldown)
+                self.failures = 0
+
+
+@dataclass
+class ErrorInfo:
+    kind: str                       # rate_limit, timeout, server, parse, auth, client, unknown
+    retryable: bool
+    retry_after: Optional[float] = None
+
+    @property
+    def provider_fault(self):
+        # Failures that say something about provider health (vs. our input).
+        return self.kind in ("rate_limit", "timeout", "server")
+
+
+_RETRY_AFTER_PATTERNS = [
+    re.compile(r"retry[_ -]?after[\"':= ]+(\d+(?:\.\d+)?)", re.I),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.I),
+    re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.I),
+]
+
+def _retry_after(exc, message):
+    for value in (getattr(exc, "retry_after", None), getattr(exc, "retry_delay", None)):
+        if isinstance(value, (int, float)):
+            return float(value)
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after", "").isdigit():
+        return float(headers["retry-after"])
+    for pattern in _RETRY_AFTER_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            return float(match.group(1))
+    return None
+
+def classify_error(exc):
+    """
+    Map an exception (or the one it wraps) to an ErrorInfo.
+
+    Provider SDK exceptions are recognised by status code / class name so this
+    module does not need to import any SDK.
+    """
+    chain = []
+    while exc is not None and exc not in chain:
+        chain.append(exc)
+        exc = exc.__cause__ or exc.__context__
+
+    message = " ".join(str(e) for e in chain)
+    names = " ".join(type(e).__name__ for e in chain)
+    codes = {getattr(e, "code", None) for e in chain} | {getattr(e, "status_code", None) for e in chain}
+    retry_after = next((r for r in (_retry_after(e, message) for e in chain) if r is not None), None)
+    lowered = message.lower()
+
+    if 429 in codes or "ResourceExhausted" in names or "TooManyRequests" in names \
+            or re.search(r"\b429\b", message) or "quota" in lowered or "rate limit" in lowered:
+        return ErrorInfo("rate_limit", True, retry_after)
+    if 408 in codes or 504 in codes or "DeadlineExceeded" in names or "Timeout" in names \
+            or "timed out" in lowered or "deadline" in lowered:
+        return ErrorInfo("timeout", True, retry_after)
+    if codes & {500, 502, 503} or "ServiceUnavailable" in names or "InternalServerError" in names:
+        return ErrorInfo("server", True, retry_after)
+    # json.JSONDecodeError is a ValueError; so are json_repair failures.
+    if any(isinstance(e, ValueError) for e in chain):
+        return ErrorInfo("parse", True)
+    if codes & {401, 403} or "PermissionDenied" in names or "Unauthenticated" in names:
+        return ErrorInfo("auth", False)
+    if codes & {400, 404} or "InvalidArgument" in names or "NotFound" in names:
+        return ErrorInfo("client", False)
+    # The replay backend has no recorded answer for the request (LookupError);
+    # asking again gives the same miss.
+    if any(isinstance(e, LookupError) for e in chain):
+        return ErrorInfo("client", False)
+    return ErrorInfo("unknown", True, retry_after)
+
+
+class RequestFailed(RuntimeError):
+    def __init__(self, label, error, attempts, cause):
+        super().__init__(f"{label}: {error.kind} after {attempts} attempt(s): {cause}")
+        self.label = label
+        self.error = error
+        self.attempts = attempts
+        self.cause = cause
+
+    def record(self, **extra):
+        return {
+            **extra,
+            "error": self.error.kind,
+            "message": str(self.cause),
+            "attempts": self.attempts,
+        }
+
+
+def estimate_tokens(*texts, images=1):
+    # ~4 characters per token is close enough for budgeting.
+    return sum(len(t) for t in texts) // 4 + images * IMAGE_TOKENS + RESPONSE_TOKENS
+
+
+class RequestScheduler:
+    def __init__(self, requests_per_minute=DEFAULT_RPM, tokens_per_minute=DEFAULT_TPM,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=1.0, max_delay=60.0,
+                 breaker=None):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+
+    def backoff(self, attempt, error):
+        # Full jitter keeps concurrent workers from retrying in lockstep.
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        return delay
+
+    def call(self, fn, *args, est_tokens=0, label="request", **kwargs):
+        """
+        Run fn(*args, **kwargs) under the rate limits, retrying retryable
+        failures. Raises RequestFailed once attempts are exhausted or the
+        error is not retryable.
+
+        Each call is one "request" metrics event: total time including
+        throttling and backoff, time spent waiting, attempts and retries.
+        """
+        start = time.perf_counter()
+        waited = 0.0
+
+        def report(attempts, failed=0):
+            pipeline_metrics.record(
+                "request", (time.perf_counter() - start) * 1000, label=label,
+                wait_ms=round(waited * 1000, 2), attempts=attempts, retries=attempts - 1,
+                failed=failed,
+            )
+
+        for attempt in range(self.max_attempts):
+            queued = time.perf_counter()
+            self.breaker.wait()
+            self.requests.acquire()
+            if est_tokens:
+                self.tokens.acquire(est_tokens)
+            waited += time.perf_counter() - queued
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                error = classify_error(e)
+                print(f"{label}: {error.kind} error (attempt {attempt + 1}/{self.max_attempts}): {e}")
+                if error.provider_fault:
+                    self.breaker.record_failure()
+                if error.kind == "rate_limit" and error.retry_after:
+                    # The provider told us when to come back: pause everyone.
+                    self.breaker.pause(error.retry_after)
+                if not error.retryable or attempt == self.max_attempts - 1:
+                    report(attempt + 1, failed=1)
+                    raise RequestFailed(label, error, attempt + 1, e) from e
+                delay = self.backoff(attempt, error)
+                print(f"{label}: retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                waited += delay
+            else:
+                self.breaker.record_success()
+                report(attempt + 1)
+                return result
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+def get_default_scheduler():
+    """Process-wide scheduler shared by every caller that does not pass one."""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler()
+        return _default_scheduler
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import uuid
+import threading
+from pathlib import Path
+
+import pipeline_metrics
+
+# Append-only result sinks for extraction runs.
+#
+# Records (one per document or one per page) are written as they arrive
+# instead of being collected into one JSON file at the end. Memory stays flat
+# however large the run is, and downstream tools can read results while the
+# run is still going.
+#
+#   JsonlSink    one JSON line per record. Each line goes out in a single
+#                write and is flushed and fsynced. A line cut short by a crash
+#                is dropped when the file is reopened with resume=True.
+#   ParquetSink  records flattened to dotted field paths (nested objects are
+#                walked, lists are stored as JSON), written as a directory of
+#                part files with ROW_GROUP records each. Every part is written
+#                to a temp file and renamed into place, so readers never see
+#                a partial file. Needs pyarrow.
+#
+# On resume both sinks know which complete records they already hold and
+# skip them, so the CLI can replay finished documents and pages from the job
+# checkpoints without writing duplicates.
+
+ROW_GROUP = int(os.getenv("RESULT_SINK_ROW_GROUP", "200"))
+
+# Record keys stored as their own Parquet columns; "data" is flattened.
+META_COLUMNS = {"pdf": "string", "page": "int64", "schema": "int64", "pages": "int64", "error": "string"}
+
+
+def record_key(record):
+    return record.get("pdf"), record.get("page")
+
+def _complete(record):
+    # Records with failures are written again once --resume fills them in.
+    return "error" not in record and not record.get("failures")
+
+def flatten_record(data, prefix="", out=None):
+    """Nested dict -> {dotted path: value}; lists stay one value."""
+    out = {} if out is None else out
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flatten_record(value, path + ".", out)
+        else:
+            out[path] = value
+    return out
+
+
+class JsonlSink:
+    def __init__(self, path, resume=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.seen = set()
+        if resume and self.path.exists():
+            self._drop_partial_line()
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if _complete(record):
+                        self.seen.add(record_key(record))
+        self._file = open(self.path, "ab" if resume else "wb")
+        self._lock = threading.Lock()
+
+    def _drop_partial_line(self):
+        with open(self.path, "rb+") as f:
+            end = pos = f.seek(0, os.SEEK_END)
+            keep = 0
+            while pos > 0:
+                step = min(65536, pos)
+                f.seek(pos - step)
+                newline = f.read(step).rfind(b"\n")
+                if newline != -1:
+                    keep = pos - step + newline + 1
+                    break
+                pos -= step
+            if keep != end:
+                f.truncate(keep)
+
+    def write(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if record_key(record) in self.seen:
+                return
+            if _complete(record):
+                self.seen.add(record_key(record))
+            start = time.perf_counter()
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        pipeline_metrics.record("export", (time.perf_counter() - start) * 1000, target="jsonl",
+                                bytes=len(line), pdf=record.get("pdf"), page=record.get("page"))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetSink:
+    def __init__(self, path, fields=None, resume=False, row_group=ROW_GROUP):
+        """
+        path      -> directory receiving part-*.parquet files
+        fields    -> dotted field paths to store as columns (e.g. from
+                     schema_compiler.schema_field_paths); by default taken
+                     from the first records. Paths outside this set go to
+                     one JSON "_extra" column, so every part has the same
+                     columns
+        row_group -> records buffered before a part is written
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow)") from e
+        self._pa, self._pq = pa, pq
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.fields = sorted(fields) if fields else None
+        self.row_group = max(1, row_group)
+        self.seen = set()
+        if resume:
+            for part in sorted(self.path.glob("part-*.parquet")):
+                table = pq.read_table(part, columns=["pdf", "page", "error"])
+                for pdf, page, error in zip(*(table.column(c).to_pylist() for c in ("pdf", "page", "error"))):
+                    if error is None:
+                        self.seen.add((pdf, page))
+        else:
+            for part in self.path.glob("part-*.parquet"):
+                part.unlink()
+
+        self._run = uuid.uuid4().hex[:8]
+        self._parts = 0
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        row = {key: record.get(key) for key in META_COLUMNS}
+        if record.get("failures") and row["error"] is None:
+            row["error"] = f"{len(record['failures'])} page(s) failed"
+        row["data"] = flatten_record(record.get("data") or {})
+        with self._lock:
+            if record_key(record) in self.seen:
+                return
+            if _complete(record):
+                self.seen.add(record_key(record))
+            self._rows.append(row)
+            if len(self._rows) >= self.row_group:
+                self._flush()
+
+    @staticmethod
+    def _text(value):
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value, ensure_ascii=False)
+
+    def _flush(self):
+        if not self._rows:
+            return
+        pa, pq = self._pa, self._pq
+        start = time.perf_counter()
+        rows, self._rows = self._rows, []
+        if self.fields is None:
+            self.fields = sorted({path for row in rows for path in row["data"]})
+        known = set(self.fields)
+
+        columns = {key: [row[key] for row in rows] for key in META_COLUMNS}
+        for path in self.fields:
+            columns[path] = [self._text(row["data"].get(path)) for row in rows]
+        extras = []
+        for row in rows:
+            extra = {k: v for k, v in row["data"].items() if k not in known}
+            extras.append(json.dumps(extra, ensure_ascii=False) if extra else None)
+        columns["_extra"] = extras
+
+        schema = pa.schema(
+            [(key, pa.type_for_alias(kind)) for key, kind in META_COLUMNS.items()]
+            + [(path, pa.string()) for path in self.fields]
+            + [("_extra", pa.string())]
+        )
+        table = pa.Table.from_pydict(columns, schema=schema)
+
+        name = f"part-{self._run}-{self._parts:05d}.parquet"
+        tmp = self.path / f".{name}.tmp"
+        try:
+            pq.write_table(table, tmp)
+            os.replace(tmp, self.path / name)
+        except BaseException:
+            if tmp.exists():
+                tmp.unlink()
+            raise
+        self._parts += 1
+        pipeline_metrics.record("export", (time.perf_counter() - start) * 1000, target="parquet",
+                                bytes=(self.path / name).stat().st_size, rows=len(rows))
+
+    def close(self):
+        with self._lock:
+            self._flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultiSink:
+    """Fans every record out to several sinks."""
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, record):
+        for sink in self.sinks:
+            sink.write(record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,149 @@
+import re
+import json
+import argparse
+
+# Compact, token-efficient rendering of the form schemas for prompts.
+#
+# A pretty-printed JSON schema spends most of its tokens on braces,
+# indentation and repeated "type"/"properties" keys. The model only needs the
+# field tree, so it is sent as an outline with one space of indent per level:
+#
+#   generalInfo
+#    date_of_birth: string
+#    mailing_address -- If different from above
+#     city: string
+#   programsServices.campus_interest: one of ["Phoenix Campus","Maricopa Campus"]
+#   medications[]
+#    name: string
+#
+# Chains of single-child objects collapse into dotted paths, `[]` marks a
+# list of objects.
+
+COMPACT_HEADER = (
+    "FIELDS (outline of the JSON to return: each indented line is a key nested "
+    "under the line above, `a.b` is a nested key, `[]` is a list of objects, "
+    "`one of`/`any of` give the allowed option values):"
+)
+
+
+def _enum(values):
+    return json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+
+def _describe(node):
+    node_type = node.get("type", "string")
+    items = node.get("items") or {}
+
+    if node_type == "array":
+        if items.get("enum"):
+            return f"any of {_enum(items['enum'])}"
+        return f"list of {items.get('type', 'string')}"
+    if node.get("enum"):
+        return f"one of {_enum(node['enum'])}"
+    return node_type
+
+def _words(text):
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+def _useful_description(path, node):
+    # Drop descriptions that only restate the field name ("Birth date:" on
+    # birth_date); they cost tokens without telling the model anything.
+    description = (node.get("description") or "").strip()
+    field = path.rsplit(".", 1)[-1].replace("[]", "")
+    if not description or _words(description) <= _words(field.replace("_", " ")):
+        return None
+    return description
+
+def iter_fields(schema, prefix=""):
+    """Yield (dotted_path, leaf_schema) for every leaf of a JSON schema."""
+    if not isinstance(schema, dict):
+        return
+    properties = schema.get("properties")
+    if properties is not None:
+        for key, sub in properties.items():
+            yield from iter_fields(sub, f"{prefix}.{key}" if prefix else key)
+        return
+    items = schema.get("items") or {}
+    if schema.get("type") == "array" and items.get("properties"):
+        yield from iter_fields(items, f"{prefix}[]")
+        return
+    if prefix:
+        yield prefix, schema
+
+def schema_field_paths(schema, prefix=""):
+    """
+    Dotted paths of the values in a result for this schema: nested objects
+    are walked, lists (of anything) are one value. Matches flatten_json.
+    """
+    paths = []
+    for key, node in (schema.get("properties") or {}).items():
+        path = f"{prefix}{key}"
+        if _is_object(node):
+            paths.extend(schema_field_paths(node, path + "."))
+        else:
+            paths.append(path)
+    return paths
+
+def _is_object(node):
+    return isinstance(node, dict) and node.get("properties") is not None
+
+def _is_object_list(node):
+    items = node.get("items") or {}
+    return node.get("type") == "array" and _is_object(items)
+
+def _outline(properties, depth, lines):
+    for key, node in properties.items():
+        if not isinstance(node, dict):
+            continue  # e.g. a stray "required": [] inside properties
+        # Collapse a -> b -> c when each level has a single child.
+        path = key
+        while _is_object(node) and len(node["properties"]) == 1 \
+                and not node.get("description"):
+            (child, node), = node["properties"].items()
+            path = f"{path}.{child}"
+
+        indent = " " * depth
+        description = _useful_description(path, node)
+        note = f" -- {description}" if description else ""
+
+        if _is_object(node):
+            lines.append(f"{indent}{path}{note}")
+            _outline(node["properties"], depth + 1, lines)
+        elif _is_object_list(node):
+            lines.append(f"{indent}{path}[]{note}")
+            _outline(node["items"]["properties"], depth + 1, lines)
+        else:
+            lines.append(f"{indent}{path}: {_describe(node)}{note}")
+
+def compact_schema(schema):
+    lines = []
+    _outline(schema.get("properties", {}), 0, lines)
+    return COMPACT_HEADER + "\n" + "\n".join(lines)
+
+def schema_text_sizes(schema):
+    """Character counts of the schema encodings, for comparing prompt cost."""
+    return {
+        "json_indent": len(json.dumps(schema, indent=2, ensure_ascii=False)),
+        "json": len(json.dumps(schema, ensure_ascii=False)),
+        "compact": len(compact_schema(schema)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the compact prompt form of a schema")
+    parser.add_argument("schemas", nargs="+", help="Schema JSON files")
+    parser.add_argument("--print", action="store_true", help="Print the compact text")
+    args = parser.parse_args()
+
+    for path in args.schemas:
+        with open(path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        if args.print:
+            print(compact_schema(schema))
+        sizes = schema_text_sizes(schema)
+        # ~4 characters per token
+        print(f"{path}: " + ", ".join(
+            f"{name} {chars} chars (~{chars // 4} tokens)" for name, chars in sizes.items()
+        ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import os
+import re
+import json
+import difflib
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Tuple
+
+# Local validation and normalization of model answers.
+#
+# Each schema is compiled once into a tree of small checker functions. A
+# checker takes the value the model returned for its field and gives back the
+# value coerced to the schema. For example, {"value": x} wrappers are
+# unwrapped, "12" becomes 12 for integer fields, "yes" becomes true for
+# booleans, near-miss enum options snap to the printed option, dates become
+# YYYY-MM-DD and phone numbers become E.164. Whatever cannot be coerced is
+# reported with its dotted path. ocr_extractor then re-asks the model for only
+# those subtrees instead of the whole page.
+#
+# Fields count as dates or phone numbers by their name, the same way the
+# synthetic backend fills them: "date"/"birth" and "phone".
+
+# Country calling code assumed for phone numbers written without one.
+DEFAULT_PHONE_COUNTRY = os.getenv("PHONE_DEFAULT_COUNTRY", "1")
+
+# Close-match cutoff for snapping a misread enum value to an option.
+ENUM_CUTOFF = 0.85
+
+DATE_FORMATS = (
+    "%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%m-%d-%Y", "%m.%d.%Y",
+    "%m/%d/%y", "%m-%d-%y", "%m.%d.%y",
+    "%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y",
+)
+TRUE_WORDS = {"true", "yes", "y", "x", "checked", "1", "on"}
+FALSE_WORDS = {"false", "no", "n", "unchecked", "0", "off"}
+
+
+@dataclass
+class Validation:
+    value: dict
+    errors: List[Tuple[str, str]] = field(default_factory=list)  # (dotted path, message)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def failing_paths(self):
+        """
+        Dotted paths of the subtrees to re-ask: the field of each error, or
+        the whole list for errors inside list items.
+        """
+        paths = []
+        for path, _ in self.errors:
+            path = path.split("[", 1)[0]
+            if path and path not in paths:
+                paths.append(path)
+        # A subtree already covers anything below it.
+        return [p for p in paths if not any(p.startswith(q + ".") for q in paths if q != p)]
+
+
+def normalize_date(text):
+    """Handwritten date -> YYYY-MM-DD, or None when it is not a full date."""
+    cleaned = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", text.strip(), flags=re.I)
+    cleaned = re.sub(r"[,\s]+", " ", cleaned).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            parsed = datetime.strptime(cleaned, fmt).date()
+        except ValueError:
+            continue
+        # Two-digit years: a date in the future belongs to the last century.
+        if "%y" in fmt and parsed > date.today():
+            parsed = parsed.replace(year=parsed.year - 100)
+        return parsed.isoformat()
+    return None
+
+def normalize_phone(text, country=DEFAULT_PHONE_COUNTRY):
+    """Phone number -> E.164 (+15555550123), or None when it cannot be made one."""
+    text = text.strip()
+    if re.search(r"(ext|x)\s*\d", text, re.I):
+        return None
+    digits = re.sub(r"\D", "", text)
+    if text.startswith("+") and 8 <= len(digits) <= 15:
+        return "+" + digits
+    if country == "1":
+        if len(digits) == 10:
+            return "+1" + digits
+        if len(digits) == 11 and digits.startswith("1"):
+            return "+" + digits
+        return None
+    if digits.startswith("00") and 10 <= len(digits) <= 17:
+        return "+" + digits[2:]
+    return None
+
+
+def _unwrap(value, keep=()):
+    # {"value": x} (optionally with confidence/notes keys) -> x, unless
+    # "value" is a real field of this node.
+    while isinstance(value, dict) and "value" in value and "value" not in keep:
+        value = value["value"]
+    return value
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in ("", "null"))
+
+def _kind(name):
+    name = name.lower()
+    if "date" in name or "birth" in name:
+        return "date"
+    if "phone" in name:
+        return "phone"
+    return None
+
+
+def _compile_object(node):
+    properties = {
+        key: _compile(sub, key)
+        for key, sub in (node.get("properties") or {}).items()
+        if isinstance(sub, dict)
+    }
+    names = set(properties)
+
+    def check(value, path, errors):
+        value = _unwrap(value, names)
+        if _blank(value):
+            value = {}
+        elif not isinstance(value, dict):
+            errors.append((path, f"expected an object, got {type(value).__name__}"))
+            value = {}
+        prefix = f"{path}." if path else ""
+        return {key: fn(value.get(key), prefix + key, errors) for key, fn in properties.items()}
+    return check
+
+def _compile_array(node, name):
+    items = node.get("items") or {}
+    item_check = _compile(items, name)
+
+    def check(value, path, errors):
+        value = _unwrap(value)
+        if _blank(value):
+            return []
+        if not isinstance(value, list):
+            if isinstance(value, dict) and not items.get("properties"):
+                errors.append((path, "expected a list, got an object"))
+                return []
+            value = [value]
+        out = []
+        for i, item in enumerate(value):
+            if _blank(item):
+                continue
+            out.append(item_check(item, f"{path}[{i}]", errors))
+        return out
+    return check
+
+def _compile_enum(options):
+    exact = {option: option for option in options}
+    folded = {" ".join(str(o).lower().split()): o for o in options}
+
+    def match(value):
+        if isinstance(value, (dict, list)):
+            return None
+        if value in exact:
+            return value
+        key = " ".join(str(value).lower().split())
+        if key in folded:
+            return folded[key]
+        prefixed = [o for k, o in folded.items() if k.startswith(key) and len(key) >= 3]
+        if len(prefixed) == 1:
+            return prefixed[0]
+        close = difflib.get_close_matches(key, list(folded), n=1, cutoff=ENUM_CUTOFF)
+        return folded[close[0]] if close else None
+
+    def check(value, path, errors):
+        value = _unwrap(value)
+        if _blank(value):
+            return None
+        # Multi-select checkbox groups come back as lists of options.
+        if isinstance(value, list):
+            out = []
+            for i, item in enumerate(_unwrap(v) for v in value):
+                if _blank(item):
+                    continue
+                option = match(item)
+                if option is None:
+                    errors.append((f"{path}[{i}]", f"{item!r} is not one of the options"))
+                elif option not in out:
+                    out.append(option)
+            return out
+        if isinstance(value, dict):
+            errors.append((path, "expected an option, got an object"))
+            return None
+        option = match(value)
+        if option is None:
+            errors.append((path, f"{value!r} is not one of the options"))
+            return value
+        return option
+    return check
+
+def _compile_scalar(node_type, name):
+    kind = _kind(name)
+
+    def check(value, path, errors):
+        value = _unwrap(value)
+        if _blank(value):
+            return None
+        if isinstance(value, (dict, list)) and not (isinstance(value, list) and node_type == "string"):
+            errors.append((path, f"expected a single value, got {type(value).__name__}"))
+            return None
+
+        if node_type == "boolean":
+            if isinstance(value, bool):
+                return value
+            word = str(value).strip().lower()
+            if word in TRUE_WORDS:
+                return True
+            if word in FALSE_WORDS:
+                return False
+            errors.append((path, f"{value!r} is not a yes/no value"))
+            return None
+
+        if node_type in ("integer", "number"):
+            if isinstance(value, bool):
+                errors.append((path, "expected a number, got a boolean"))
+                return None
+            try:
+                number = float(str(value).strip().replace(",", ""))
+            except ValueError:
+                errors.append((path, f"{value!r} is not a number"))
+                return None
+            if node_type == "integer":
+                if not number.is_integer():
+                    errors.append((path, f"{value!r} is not a whole number"))
+                    return None
+                return int(number)
+            return int(number) if number.is_integer() and isinstance(value, int) else number
+
+        # Strings: lists of text (several lines written in one box) are joined.
+        if isinstance(value, list):
+            value = "; ".join(str(_unwrap(v)) for v in value if not _blank(_unwrap(v)))
+            if not value:
+                return None
+        text = value if isinstance(value, str) else str(value)
+        if kind == "date":
+            return normalize_date(text) or text
+        if kind == "phone":
+            return normalize_phone(text) or text
+        return text
+    return check
+
+def _compile(node, name=""):
+    if not isinstance(node, dict):
+        return lambda value, path, errors: value
+    if node.get("properties") is not None:
+        return _compile_object(node)
+    node_type = node.get("type")
+    if node_type == "array":
+        return _compile_array(node, name)
+    if node.get("enum"):
+        return _compile_enum(node["enum"])
+    if node_type in ("string", "boolean", "integer", "number"):
+        return _compile_scalar(node_type, name)
+    return lambda value, path, errors: _unwrap(value)
+
+
+class SchemaValidator:
+    def __init__(self, schema):
+        self.schema = schema
+        self._check = _compile(schema)
+
+    def validate(self, data):
+        """Model answer -> Validation(coerced value, [(path, message)])."""
+        errors = []
+        value = self._check(data, "", errors)
+        return Validation(value if isinstance(value, dict) else {}, errors)
+
+
+@lru_cache(maxsize=256)
+def _validator(schema_json):
+    return SchemaValidator(json.loads(schema_json))
+
+# Validators of schema dicts already seen, by identity, so the long-lived
+# schemas of a run are not serialized again for every page. Each entry keeps
+# its schema alive, so its id cannot be reused while it is cached.
+_by_identity = OrderedDict()
+_by_identity_lock = threading.Lock()
+
+def validator_for(schema):
+    """
+    Compiled validator for a schema dict, built once per distinct schema.
+    Schemas are treated as read-only: a dict seen before gets its validator
+    back without being serialized again.
+    """
+    key = id(schema)
+    with _by_identity_lock:
+        entry = _by_identity.get(key)
+        if entry is not None and entry[0] is schema:
+            _by_identity.move_to_end(key)
+            return entry[1]
+    validator = _validator(json.dumps(schema))
+    with _by_identity_lock:
+        _by_identity[key] = (schema, validator)
+        while len(_by_identity) > 256:
+            _by_identity.popitem(last=False)
+    return validator
+
+
+def sub_schema(schema, paths):
+    """Copy of `schema` with only the given dotted paths (whole subtrees) and their ancestors."""
+    wanted = {}
+    for path in paths:
+        node = wanted
+        parts = path.split(".")
+        for part in parts[:-1]:
+            if node.get(part, {}) is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+
+    def prune(node, keep):
+        properties = node.get("properties") or {}
+        out = {k: v for k, v in node.items() if k != "properties"}
+        out["properties"] = {
+            key: properties[key] if sub is None else prune(properties[key], sub)
+            for key, sub in keep.items()
+            if key in properties and (sub is None or isinstance(properties[key], dict))
+        }
+        return out
+    return prune(schema, wanted)
+
+def get_path(data, path):
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+def set_path(data, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    data[parts[-1]] = value
@@ -0,0 +1,256 @@
+import io
+import json
+import os
+import argparse
+from copy import deepcopy
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from datetime import datetime
+
+import pandas as pd
+
+from schema_compiler import schema_field_paths
+
+# Therap IDF export.
+#
+# Flattens reviewed page data, maps it onto the columns of the IDF import
+# template via field_mapping.json, and keeps unmapped fields in a separate
+# "extra fields" frame.
+#
+# field_mapping.json is compiled once against the template (and the schemas,
+# when given) into an ExportPlan: the dotted field path feeding each template
+# column, plus what does not line up. Many forms are then flattened in one
+# pass into a multi-row import frame.
+
+BASE_DIR = Path(__file__).resolve().parent
+MAPPING_FILE = BASE_DIR / "field_mapping.json"
+IDF_TEMPLATE = BASE_DIR / "IDF_Import_ProviderExcel_TOT-AZ_20251019.xlsx"
+
+
+def flatten_json(data, parent_key="", sep="."):
+    items = {}
+    for k, v in data.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.update(flatten_json(v, new_key, sep))
+        else:
+            items[new_key] = v
+    return items
+
+# The mapping and the template header are read once per process and reused
+# until the file changes on disk (the cache key includes its mtime).
+@lru_cache(maxsize=8)
+def _load_mapping(path, mtime):
+    with open(path, "r") as f:
+        mapping_json = json.load(f)
+    mapping = mapping_json.get("mappings", {})
+    return {v: k for k, v in mapping.items() if v}
+
+@lru_cache(maxsize=8)
+def _load_template_columns(path, mtime):
+    # Header row only: the template's data rows are never used.
+    return tuple(pd.read_excel(path, nrows=0).columns)
+
+def load_reverse_mapping(mapping_path=MAPPING_FILE):
+    """{template column: extracted field key}, cached per file version."""
+    path = str(mapping_path)
+    return _load_mapping(path, os.path.getmtime(path))
+
+def load_template_columns(template_path=IDF_TEMPLATE):
+    """Column names of the IDF import template, cached per file version."""
+    path = str(template_path)
+    return list(_load_template_columns(path, os.path.getmtime(path)))
+
+@dataclass(frozen=True)
+class ExportPlan:
+    columns: tuple          # IDF template columns, in template order
+    sources: tuple          # dotted field path feeding each column, or None
+    unmapped_fields: tuple  # schema fields without a column (extra fields)
+    unknown_paths: tuple    # mapped paths no schema defines (never filled)
+    unknown_columns: tuple  # mapping targets missing from the template
+
+    @property
+    def mapped_paths(self):
+        return frozenset(source for source in self.sources if source)
+
+
+def compile_export_plan(schemas=None, mapping_path=MAPPING_FILE, template_path=IDF_TEMPLATE):
+    """
+    schemas -> optional {schema_num: schema} (or list) to validate the
+               mapping against; without it only the template is checked
+    """
+    reverse_map = load_reverse_mapping(mapping_path)
+    columns = tuple(load_template_columns(template_path))
+    sources = tuple(reverse_map.get(col) for col in columns)
+    mapped = {source for source in sources if source}
+
+    unmapped, unknown = (), ()
+    if schemas is not None:
+        if isinstance(schemas, dict):
+            schemas = schemas.values()
+        fields = {path for schema in schemas for path in schema_field_paths(schema)}
+        unmapped = tuple(sorted(fields - mapped))
+        unknown = tuple(sorted(mapped - fields))
+
+    return ExportPlan(
+        columns=columns,
+        sources=sources,
+        unmapped_fields=unmapped,
+        unknown_paths=unknown,
+        unknown_columns=tuple(sorted(set(reverse_map) - set(columns))),
+    )
+
+
+def _deep_update(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_update(target[key], value)
+        elif value is not None or target.get(key) is None:
+            target[key] = deepcopy(value) if isinstance(value, (dict, list)) else value
+
+def merge_record(pages):
+    """
+    One form's page results -> one nested dict. Sections that appear on
+    several pages are merged field by field (a later page never blanks a
+    value with null); the inputs are not modified.
+    """
+    if isinstance(pages, dict):
+        pages = [pages[num] for num in sorted(pages)]
+    merged = {}
+    for page_data in pages:
+        if isinstance(page_data, dict):
+            _deep_update(merged, page_data)
+    return merged
+
+def _as_record(data):
+    # {page_num: page_dict} as kept by the app, or an already merged form.
+    if data and all(isinstance(key, int) for key in data):
+        return merge_record(data)
+    return data
+
+def build_bulk_export_frames(records, plan=None, record_ids=None):
+    """
+    records    -> forms, each {page_num: page_dict} (st.session_state.extracted_data)
+                  or an already merged dict (ocr_extractor output)
+    plan       -> ExportPlan (compiled from the default mapping and template if None)
+    record_ids -> optional label per record, added as a "record" column to
+                  the extra-fields frame so its rows can be traced back
+
+    Returns (official_df, extra_df) with one row per record, in order.
+    """
+    plan = plan or compile_export_plan()
+    flat = pd.json_normalize([_as_record(record) for record in records], sep=".")
+
+    # One reindex builds the whole import frame: mapped columns come from
+    # the flattened fields, everything else is blank.
+    official_df = flat.reindex(columns=list(plan.sources), fill_value="").set_axis(list(plan.columns), axis=1)
+
+    mapped = plan.mapped_paths
+    extra_cols = [c for c in flat.columns if c not in mapped]
+    if not extra_cols:
+        return official_df, pd.DataFrame()
+    extra_df = flat[extra_cols]
+    if record_ids is not None:
+        extra_df = extra_df.copy()
+        extra_df.insert(0, "record", list(record_ids))
+    return official_df, extra_df
+
+def build_export_frames(edited_data, mapping_path=MAPPING_FILE, template_path=IDF_TEMPLATE, plan=None):
+    """
+    edited_data -> {page_num: page_dict} as kept in st.session_state.extracted_data
+
+    Returns (official_df, extra_df): the import-ready frame with the template's
+    columns and a frame with every extracted field that has no mapping.
+    """
+    plan = plan or compile_export_plan(None, mapping_path, template_path)
+    return build_bulk_export_frames([merge_record(edited_data)], plan)
+
+def to_xlsx_bytes(df):
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+def export_workbooks(official_df, extra_df):
+    """Both workbooks in memory; returns (official_bytes, extra_bytes or None)."""
+    official = to_xlsx_bytes(official_df)
+    return official, (None if extra_df.empty else to_xlsx_bytes(extra_df))
+
+def export_file_names(base_name="export"):
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{base_name}_import_ready_{ts}.xlsx", f"{base_name}_extra_fields_{ts}.xlsx"
+
+def write_export_files(official_df, extra_df, base_name="export", out_dir="."):
+    """Write both workbooks with a timestamp; returns (official_file, extra_file or None)."""
+    official_name, extra_name = export_file_names(base_name)
+    official_file = f"{out_dir}/{official_name}"
+    extra_file = f"{out_dir}/{extra_name}"
+
+    official_df.to_excel(official_file, index=False)
+
+    if extra_df.empty:
+        return official_file, None
+    extra_df.to_excel(extra_file, index=False)
+    return official_file, extra_file
+
+
+def load_records(paths):
+    """(record id, form dict) from per-PDF JSON files and --jsonl batch files."""
+    for path in map(Path, paths):
+        if path.suffix == ".jsonl":
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if "data" in record:
+                        yield Path(record.get("pdf", path.stem)).stem, record["data"]
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                yield path.stem, json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export extracted forms to the Therap IDF import format")
+    parser.add_argument("inputs", nargs="*", help="Extracted JSON files and/or JSON Lines batch files")
+    parser.add_argument("--schemas", default=str(BASE_DIR / "schemas"), help="Schema directory to validate the mapping against")
+    parser.add_argument("--mapping", default=str(MAPPING_FILE))
+    parser.add_argument("--template", default=str(IDF_TEMPLATE))
+    parser.add_argument("--out-dir", default=".", help="Where to write the workbooks")
+    parser.add_argument("--name", default="export", help="Workbook name prefix")
+    parser.add_argument("--check", action="store_true", help="Only report mapping problems")
+    args = parser.parse_args()
+
+    schemas = {}
+    for path in sorted(Path(args.schemas).glob("schema*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            schemas[path.stem] = json.load(f)
+    plan = compile_export_plan(schemas or None, args.mapping, args.template)
+
+    print(f"{len(plan.mapped_paths)} of {len(plan.columns)} template columns mapped")
+    if plan.unknown_columns:
+        print(f"Mapped to columns missing from the template: {', '.join(plan.unknown_columns)}")
+    if plan.unknown_paths:
+        print(f"{len(plan.unknown_paths)} mapped fields are not in any schema:")
+        for path in plan.unknown_paths:
+            print(f"  {path}")
+    if plan.unmapped_fields:
+        print(f"{len(plan.unmapped_fields)} schema fields have no column (go to the extra fields file)")
+    if args.check:
+        return
+    if not args.inputs:
+        parser.error("no input files")
+
+    loaded = list(load_records(args.inputs))
+    if not loaded:
+        parser.error("no extracted records in the input files")
+    ids, records = zip(*loaded)
+    official_df, extra_df = build_bulk_export_frames(records, plan, record_ids=ids)
+    official_file, extra_file = write_export_files(official_df, extra_df, args.name, args.out_dir)
+    print(f"{len(official_df)} records -> {official_file}")
+    if extra_file:
+        print(f"Extra fields -> {extra_file}")
+
+if __name__ == "__main__":
+    main()